@@ -1,25 +1,74 @@
+import threading
 import streamlit as st
 from library.Plot import *
 from library.Function import *
 from library.Variable import *
+from library.Pipeline import Pipeline
+from library.Profile import StageProfiler
 wider_layout = True
 st.set_page_config(layout="wide" if wider_layout else "centered")
+
+
+@st.cache_resource
+def shared_pipeline():
+    """One pipeline and its lock for every session of this server process"""
+    return Pipeline(f1=0.1, f2=0.25, c1=0.01, c2=0.01), threading.Lock()
+
+
+@st.cache_data(max_entries=16, show_spinner="Generating RR intervals and ECG signal...")
+def generate_record(duration, hmean, hstd, fs, seed, track_memory=False):
+    """Every stage result of one parameter set, cached for all sessions
+
+    A miss runs the shared pipeline, which still reuses the stages whose inputs did
+    not change, e.g. spectrum and phases when only hstd differs.
+    """
+    pipeline, lock = shared_pipeline()
+    profiler = StageProfiler(memory=track_memory)
+    with lock:
+        stages = pipeline.set(duration=duration, hmean=hmean, hstd=hstd, fs=fs, seed=seed).run(profiler=profiler)
+    stages['profile'] = profiler.summary()
+    return stages
+
+
 class App:
     def __init__(self):
         self.f1 = 0.1
         self.f2 = 0.25
         self.c1 = 0.01
         self.c2 = 0.01
-        
-        self.duration = st.sidebar.number_input("Duration (seconds)", min_value=1, max_value=600, value=10)
-        self.hmean = st.sidebar.number_input("Mean Heart Rate (BPM)", min_value=30, max_value=180, value=60)
-        self.hstd = st.sidebar.number_input("Heart Rate Std Dev (BPM)", min_value=0.0, max_value=20.0, value=1.0)
-        self.fs = st.sidebar.number_input("Sampling Frequency (Hz)", min_value=128, max_value=1024, value=256)        
+
+        # A fixed starting seed lets every session share the cached results
+        if 'seed' not in st.session_state:
+            st.session_state.seed = 0
+
+        # Nothing is generated until Generate is pressed
+        with st.sidebar.form("parameters"):
+            duration = st.number_input("Duration (seconds)", min_value=1, max_value=600, value=10)
+            hmean = st.number_input("Mean Heart Rate (BPM)", min_value=30, max_value=180, value=60)
+            hstd = st.number_input("Heart Rate Std Dev (BPM)", min_value=0.0, max_value=20.0, value=1.0)
+            fs = st.number_input("Sampling Frequency (Hz)", min_value=128, max_value=1024, value=256)
+            seed = st.number_input("Seed", min_value=0, max_value=2**32 - 1, step=1, key='seed')
+            submitted = st.form_submit_button("Generate")
+        st.sidebar.button("New random realization", on_click=self.new_realization)
+        self.track_memory = st.sidebar.checkbox("Track stage memory", help="Peak memory per stage, slows down generation")
+
+        if submitted or 'request' not in st.session_state:
+            st.session_state.request = (duration, hmean, hstd, fs, int(seed))
+        self.duration, self.hmean, self.hstd, self.fs, self.seed = st.session_state.request
         self.Nrr = int(self.duration * self.fs)
 
+        self.stages = generate_record(*st.session_state.request, track_memory=self.track_memory)
+
         self.initialize_parameters()
         self.generate_ecg_signal()
-    
+
+    @staticmethod
+    def new_realization():
+        """New random phases for the record on display"""
+        st.session_state.seed = int(np.random.SeedSequence().generate_state(1)[0])
+        if 'request' in st.session_state:
+            st.session_state.request = st.session_state.request[:4] + (st.session_state.seed,)
+
     def initialize_parameters(self):
         col1,col2,col3,col4 = st.columns(4)
         with col1:
@@ -34,77 +83,56 @@ class App:
         with col4:
             st.metric("Mean HR", f"{self.hmean} BPM")
             st.metric("HR Std Dev", f"{self.hstd} BPM")
-    
+
     def generate_rr_intervals(self):
-        with st.spinner("Generating RR intervals..."):
-            Sw, total = Function.gaussianLoop(self.Nrr, self.f1, self.f2, self.c1, self.c2)
-    
-            real_0, imag_0 = Function.randomPhase(Sw,self.Nrr)
-            real, imag = Function.idft(real_0, imag_0, self.Nrr)
-            S = (real + imag) * 2
-    
-            rr_intervals = Utility.scaling(S, self.hmean, self.hstd)
-            # rr_intervals = Utility.scaling(S, self.hmean) 
-            
-            col1 , col2 = st.columns(2)
-            with col1:
-                singlePlot(total, title="Total Power Spectrum", xlabel="Sample Index", ylabel="RR Interval (s)", mode='streamlit')
-                combine2Plot(real_0, imag_0, label="real", label2="imag", mode='streamlit')
-            with col2:
-                singlePlot(Sw, title="RSA Mayer", xlabel="Sample Index", ylabel="RR Interval (s)", mode='streamlit')
-                singlePlot(rr_intervals, title="Generated RR Intervals", xlabel="Sample Index", ylabel="RR Interval (s)", mode='streamlit')
-    
+        stages = self.stages
+        Sw, total = stages['spectrum']['Sw'], stages['spectrum']['total']
+        real_0, imag_0 = stages['phase']
+        rr_intervals = stages['rr']
+
+        col1 , col2 = st.columns(2)
+        with col1:
+            singlePlot(total, title="Total Power Spectrum", xlabel="Sample Index", ylabel="RR Interval (s)", mode='streamlit')
+            combine2Plot(real_0, imag_0, label="real", label2="imag", mode='streamlit')
+        with col2:
+            singlePlot(Sw, title="RSA Mayer", xlabel="Sample Index", ylabel="RR Interval (s)", mode='streamlit')
+            singlePlot(rr_intervals, title="Generated RR Intervals", xlabel="Sample Index", ylabel="RR Interval (s)", mode='streamlit')
+
         return rr_intervals
-    
-    def HRV_metrics(self, rr_intervals):   
-        with st.spinner("Calculating HRV metrics..."):    
-            info = {
-                    'SDNN': Utility.SDNN(rr_intervals),
-                    'RMSSD': Utility.RMSSD(rr_intervals),
-                    'pNN50': Utility.pNN50(rr_intervals)
-                }
-            return info
-    
+
     def generate_ecg_signal(self):
-        with st.spinner("Generating ECG signal..."):
-            rr_intervals = self.generate_rr_intervals()            
-            info = self.HRV_metrics(rr_intervals)
-        
-        theta = Angle(p=-60, q=-15, r=0, s=15, t=90)  # Angles in degrees
-        theta.to_radians()
-
-        Alpha = Amplitude(p=1.2, q=-5.0, r=30.0, s=-7.5, t=0.75)
-        Beta = Amplitude(p=0.25, q=0.1, r=0.1, s=0.1, t=0.4)
-
-        hfactor1, hfactor2 = Utility.doubleFactorial(self.hmean)
-
-        Beta.scale_by(hfactor2)
-
-        theta.p = theta.p * hfactor2
-        theta.q = theta.q * hfactor1
-        theta.s = theta.s * hfactor1
-        theta.t = theta.t * hfactor2
-        dt = 1 / self.fs
-        result = Function.solveEcgModel(dt, self.Nrr, {
-            'dt': dt,
-            'rr_series': rr_intervals,
-            'ai': [Alpha.p, Alpha.q, Alpha.r, Alpha.s, Alpha.t],
-            'bi': [Beta.p, Beta.q, Beta.r, Beta.s, Beta.t],
-            'ti': [theta.p, theta.q, theta.r, theta.s, theta.t]
-        }) 
-        
-        time = np.arange(0, len(result)) / self.fs
+        rr_intervals = self.generate_rr_intervals()
+        info = self.stages['metrics']
+
+        result = self.stages['ecg']
+
+        time = self.stages['time']
         singlePlot(time, result, title='ECG Signal', xlabel='Time', ylabel='Amplitude', mode='streamlit')
-        
+
         col1, col2, col3, col4 = st.columns(4)
         with col1:
             st.metric("SDNN", f"{info['SDNN']:.2f} ms")
         with col2:
-            st.metric("RMSSD", f"{info['RMSSD']:.2f} ms") 
+            st.metric("RMSSD", f"{info['RMSSD']:.2f} ms")
         with col3:
             st.metric("pNN50", f"{info['pNN50']:.2f} %")
         with col4:
             st.metric("BPM", f"{60 / np.mean(rr_intervals):.2f}")
-        
+
+        self.stage_timings()
+
+    def stage_timings(self):
+        profile = self.stages['profile']
+        if not profile:
+            st.caption("All stages reused from cache")
+            return
+
+        st.caption(f"Stage timings when this record (seed {self.seed}) was generated")
+        for col, (stage, entry) in zip(st.columns(len(profile)), profile.items()):
+            with col:
+                st.metric(f"{stage} time", f"{entry['wall']:.3f} s")
+                memory = '' if entry['peak_bytes'] is None else f", peak {entry['peak_bytes'] / 1024**2:.1f} MiB"
+                st.caption(f"CPU {entry['cpu']:.3f} s{memory}")
+
 if __name__ == "__main__":
-    app = App()
\ No newline at end of file
+    app = App()
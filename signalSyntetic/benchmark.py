@@ -0,0 +1,265 @@
+"""Benchmark every generation stage over a sweep of record lengths
+
+    python benchmark.py run --out results.json
+    python benchmark.py run --out quick.json --durations 10 60 --fs 256 --only solveEcgModel generate
+    python benchmark.py compare before.json results.json --threshold 0.1
+
+run times each benchmark at every (duration, fs) pair, best of --repeat runs
+after one untimed warm-up run, and writes wall time, throughput in samples per
+second and the tracemalloc peak of one extra run to a JSON file. Cases with more samples than the benchmark's limit
+(the per-sample Python loops, plot rendering and, above 25M samples, the RR
+stages that need about 85 B/sample) are skipped; --max-samples replaces every
+limit. The JSON file is rewritten after every case, so an interrupted sweep
+keeps the cases it finished.
+
+compare matches two result files case by case and flags the cases that got
+slower or use more memory by more than the threshold. It exits with status 1
+when any case regressed, so it can gate a change.
+"""
+import argparse
+import functools
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+from library.Function import Function, Utility, generate, generateStages, spectrumCache
+from library.Variable import Morphology
+
+SPECTRUM = (0.1, 0.25, 0.01, 0.01)  # f1, f2, c1, c2
+HMEAN = 60
+HSTD = 1.0
+
+DURATIONS = (10, 60, 600, 3600, 86400)
+SAMPLING_RATES = (128, 256, 512, 1024)
+
+
+@functools.lru_cache(maxsize=1)
+def record(duration, fs):
+    """Inputs shared by the benchmarks of one case, generated outside the timing"""
+    stages = generateStages(*SPECTRUM, duration, HMEAN, fs, HSTD, seed=0)
+    params = dict(Morphology.default().scaled(HMEAN), dt=1 / fs, rr_series=stages['rr_intervals'])
+    return stages, params
+
+
+def bench_gaussianLoop(duration, fs):
+    Nrr = int(duration * fs)
+    return lambda: Function.gaussianLoop(Nrr, *SPECTRUM)
+
+
+def bench_randomPhase(duration, fs):
+    Sw = record(duration, fs)[0]['spectrum']
+    return lambda: Function.randomPhase(Sw, len(Sw), 0)
+
+
+def bench_idft(duration, fs):
+    stages = record(duration, fs)[0]
+    return lambda: Function.idft(stages['real_phase'], stages['imag_phase'], stages['Nrr'])
+
+
+def bench_scaling(duration, fs):
+    unit = record(duration, fs)[0]['unit_series']
+    return lambda: Utility.scaling(unit, HMEAN, HSTD)
+
+
+def bench_hrv(duration, fs):
+    rr = record(duration, fs)[0]['rr_intervals']
+    return lambda: (Utility.SDNN(rr), Utility.RMSSD(rr), Utility.pNN50(rr))
+
+
+def bench_solveEcgModel(duration, fs):
+    params = record(duration, fs)[1]
+    return lambda: Function.solveEcgModel(1 / fs, int(duration * fs), params)
+
+
+def bench_solveEcgVectorized(duration, fs):
+    params = record(duration, fs)[1]
+    return lambda: Function.solveEcgVectorized(1 / fs, int(duration * fs), params)
+
+
+def bench_plot(duration, fs):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from library.Plot import singlePlotWithTime
+
+    samples = int(duration * fs)
+    ecg = Function.solveEcgVectorized(1 / fs, samples, record(duration, fs)[1])
+    t = np.arange(samples) / fs
+
+    def draw():
+        # Agg has no window, draw the figure where it would be shown
+        show = plt.show
+        plt.show = lambda *args, **kwargs: plt.gcf().canvas.draw()
+        try:
+            singlePlotWithTime(t, ecg, title='ECG Signal')
+        finally:
+            plt.show = show
+    return draw
+
+
+def bench_generate(duration, fs):
+    def run():
+        # record() already cached this spectrum, time the full cold run
+        spectrumCache.clear()
+        return generate(*SPECTRUM, duration, HMEAN, fs, HSTD, seed=0)
+    return run
+
+
+# The RR stages record() keeps take about 85 B/sample, 2 GB at this length
+RR_SAMPLES = 25_000_000
+
+# name: (prepare(duration, fs) -> callable, max samples or None)
+BENCHMARKS = {
+    'gaussianLoop': (bench_gaussianLoop, RR_SAMPLES),
+    'randomPhase': (bench_randomPhase, RR_SAMPLES),
+    'idft': (bench_idft, RR_SAMPLES),
+    'scaling': (bench_scaling, RR_SAMPLES),
+    'hrv': (bench_hrv, RR_SAMPLES),
+    'solveEcgModel': (bench_solveEcgModel, 250_000),
+    'solveEcgVectorized': (bench_solveEcgVectorized, RR_SAMPLES),
+    'plot': (bench_plot, 1_000_000),
+    'generate': (bench_generate, RR_SAMPLES),
+}
+
+
+def measure(func, repeat):
+    """Best wall time of repeat calls, then the tracemalloc peak of one more call
+
+    An untimed first call keeps lazy imports and first-use setup out of the timing.
+    """
+    func()
+
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return best, peak
+
+
+def run(args):
+    names = args.only or list(BENCHMARKS)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        raise SystemExit(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    meta = {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count(),
+        'repeat': args.repeat
+    }
+
+    results = []
+    for duration in args.durations:
+        for fs in args.fs:
+            samples = int(duration * fs)
+            for name in names:
+                prepare, limit = BENCHMARKS[name]
+                limit = args.max_samples or limit
+                if limit is not None and samples > limit:
+                    print(f"{name:<20} {duration:>7g} s {fs:>5} Hz  skipped, over {limit} samples")
+                    continue
+
+                elapsed, peak = measure(prepare(duration, fs), args.repeat)
+                results.append({
+                    'benchmark': name,
+                    'duration': float(duration),
+                    'fs': fs,
+                    'samples': samples,
+                    'time': elapsed,
+                    'throughput': samples / elapsed,
+                    'peak_bytes': peak
+                })
+                print(f"{name:<20} {duration:>7g} s {fs:>5} Hz  {elapsed:10.4f} s  "
+                      f"{samples / elapsed:12.4g} samples/s  {peak / 1024**2:9.1f} MiB")
+                # Written after every case, an interrupted sweep keeps what it measured
+                save(args.out, meta, results)
+            record.cache_clear()
+
+    save(args.out, meta, results)
+    print(f"{len(results)} results written to {args.out}")
+
+
+def save(path, meta, results):
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'meta': meta, 'results': results}, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def compare(args):
+    def load(path):
+        with open(path) as f:
+            return {(r['benchmark'], r['duration'], r['fs']): r for r in json.load(f)['results']}
+
+    base = load(args.base)
+    new = load(args.new)
+
+    regressions = 0
+    for key in sorted(base.keys() & new.keys()):
+        before, after = base[key], new[key]
+        speedup = before['time'] / after['time']
+        memory = after['peak_bytes'] / max(before['peak_bytes'], 1)
+
+        flags = []
+        if max(before['time'], after['time']) >= args.min_time and speedup < 1 / (1 + args.threshold):
+            flags.append('SLOWER')
+        if memory > 1 + args.threshold and after['peak_bytes'] - before['peak_bytes'] > 1024**2:
+            flags.append('MORE MEMORY')
+        regressions += bool(flags)
+
+        name, duration, fs = key
+        print(f"{name:<20} {duration:>7g} s {fs:>5} Hz  {before['time']:10.4f} -> {after['time']:10.4f} s "
+              f"({speedup:6.2f}x)  memory {memory:6.2f}x  {' '.join(flags)}")
+
+    missing = len(base.keys() ^ new.keys())
+    if missing:
+        print(f"{missing} cases only in one of the files were not compared")
+    print(f"{regressions} regressions")
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the RR and ECG generation stages")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="run the benchmarks and write the results")
+    run_parser.add_argument('--out', required=True, help="JSON results file")
+    run_parser.add_argument('--durations', type=float, nargs='+', default=DURATIONS, help="record lengths in seconds")
+    run_parser.add_argument('--fs', type=int, nargs='+', default=SAMPLING_RATES, help="sampling frequencies in Hz")
+    run_parser.add_argument('--only', nargs='+', help=f"benchmarks to run, of {', '.join(BENCHMARKS)}")
+    run_parser.add_argument('--repeat', type=int, default=3, help="timed runs per case, the best is kept")
+    run_parser.add_argument('--max-samples', type=int, help="sample limit for every benchmark")
+
+    compare_parser = commands.add_parser('compare', help="flag regressions between two result files")
+    compare_parser.add_argument('base', help="results before the change")
+    compare_parser.add_argument('new', help="results after the change")
+    compare_parser.add_argument('--threshold', type=float, default=0.1, help="allowed relative slowdown or memory growth")
+    compare_parser.add_argument('--min-time', type=float, default=1e-3, help="ignore timings below this many seconds")
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        run(args)
+        return 0
+    return compare(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
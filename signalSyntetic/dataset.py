@@ -0,0 +1,190 @@
+"""Generate a synthetic ECG dataset in parallel, as resumable shard files
+
+    python dataset.py --records 100000 --seed 0 --out data/ --spec spec.json
+
+The spec is a JSON object of Pipeline parameters. A value is used as is, a
+[low, high] pair is drawn uniformly per record, e.g.
+
+    {"duration": 10, "fs": 256, "engine": "vectorized", "hmean": [50, 90], "hstd": [0.5, 3.0]}
+
+Every record draws its parameters and random phases from streams spawned off
+the root seed by record id (Utility.recordSeed), so dataset.generate_record
+regenerates any single record without the ones before it. Add "phase_chunk": N
+to the spec to split the phases of every record into independent streams of N
+frequency bins as well.
+
+Records are grouped into shards of --shard-size records. Every worker process
+writes its own shard-NNNNN.npz and the main process appends one line per
+finished shard to manifest.jsonl, so running the same command again after an
+interruption only generates the shards that are missing.
+
+Each manifest entry carries the wall time, CPU time and (with --profile-memory)
+tracemalloc peak of every pipeline stage over its shard; profile.json sums them
+over the whole dataset.
+"""
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from library.Function import Utility
+from library.Pipeline import Pipeline
+from library.Profile import StageProfiler
+
+# Record length must be the same for every record of a shard
+FIXED_PARAMETERS = ('duration', 'fs', 'method', 'domain', 'engine')
+
+
+def load_spec(path):
+    spec = {}
+    if path:
+        with open(path) as f:
+            spec = json.load(f)
+
+    unknown = set(spec) - (set(Pipeline.DEFAULTS) - {'seed'})
+    if unknown:
+        raise ValueError(f"Unknown spec parameters: {', '.join(sorted(unknown))}")
+    for name in FIXED_PARAMETERS:
+        if isinstance(spec.get(name), list):
+            raise ValueError(f"'{name}' cannot be a range, it fixes the record layout")
+
+    return spec
+
+
+def record_params(spec, root_seed, record_id):
+    """Pipeline parameters of one record, drawn from its own seed stream"""
+    rng = np.random.default_rng(Utility.recordSeed(root_seed, record_id, 0))
+    params = {}
+    for name, value in spec.items():
+        if isinstance(value, list):
+            low, high = value
+            params[name] = float(rng.uniform(low, high))
+        else:
+            params[name] = value
+    params['seed'] = Utility.recordSeed(root_seed, record_id, 1)
+    return params
+
+
+def generate_record(spec, root_seed, record_id, pipeline=None, profiler=None):
+    """Generate one record on its own, identical to its copy inside the dataset
+
+    Returns the record parameters and the pipeline stages.
+    """
+    params = record_params(spec, root_seed, record_id)
+    stages = (pipeline or Pipeline()).set(**params).run(['ecg', 'metrics'], profiler=profiler)
+    return params, stages
+
+
+def generate_shard(out_dir, shard, start, stop, spec, root_seed, profile_memory=False):
+    """Worker: generate records [start, stop) into shard file, return its manifest entry"""
+    pipeline = Pipeline()
+    profiler = StageProfiler(memory=profile_memory)
+    ecg, rr, rr_offsets = [], [], [0]
+    values = {name: [] for name in spec}
+    metrics = {name: [] for name in ('SDNN', 'RMSSD', 'pNN50', 'BPM')}
+
+    for record_id in range(start, stop):
+        params, stages = generate_record(spec, root_seed, record_id, pipeline, profiler)
+
+        ecg.append(stages['ecg'])
+        rr.append(stages['rr'])
+        rr_offsets.append(rr_offsets[-1] + len(stages['rr']))
+        for name in spec:
+            values[name].append(params[name])
+        for name, value in stages['metrics'].items():
+            metrics[name].append(value)
+
+    name = f"shard-{shard:05d}.npz"
+    path = os.path.join(out_dir, name)
+    with open(path + '.tmp', 'wb') as f:
+        np.savez(
+            f,
+            record_id=np.arange(start, stop),
+            ecg=np.stack(ecg),
+            rr=np.concatenate(rr),
+            rr_offsets=np.array(rr_offsets),
+            **{f"param_{key}": np.array(value) for key, value in values.items()},
+            **{f"metric_{key}": np.array(value) for key, value in metrics.items()}
+        )
+    # Only complete shards ever carry the final name
+    os.replace(path + '.tmp', path)
+
+    return {'shard': shard, 'file': name, 'start': start, 'stop': stop, 'profile': profiler.summary()}
+
+
+def read_manifest(out_dir):
+    done = {}
+    path = os.path.join(out_dir, 'manifest.jsonl')
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    if os.path.exists(os.path.join(out_dir, entry['file'])):
+                        done[entry['shard']] = entry
+    return done
+
+
+def check_run(out_dir, run):
+    """Store the run settings, or make sure a resumed run uses the same ones"""
+    path = os.path.join(out_dir, 'run.json')
+    if os.path.exists(path):
+        with open(path) as f:
+            previous = json.load(f)
+        if previous != run:
+            raise SystemExit(f"{out_dir} holds a different run, use a new output directory")
+    else:
+        with open(path, 'w') as f:
+            json.dump(run, f, indent=2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a sharded synthetic ECG dataset")
+    parser.add_argument('--spec', help="JSON file of pipeline parameters or [low, high] ranges")
+    parser.add_argument('--records', type=int, required=True, help="number of records")
+    parser.add_argument('--seed', type=int, default=0, help="root seed of the dataset")
+    parser.add_argument('--out', required=True, help="output directory")
+    parser.add_argument('--shard-size', type=int, default=256, help="records per shard file")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument('--profile-memory', action='store_true', help="record tracemalloc peaks, slows down generation")
+    args = parser.parse_args(argv)
+
+    spec = load_spec(args.spec)
+    os.makedirs(args.out, exist_ok=True)
+    check_run(args.out, {
+        'spec': spec,
+        'records': args.records,
+        'seed': args.seed,
+        'shard_size': args.shard_size
+    })
+
+    done = read_manifest(args.out)
+    shards = [
+        (shard, start, min(start + args.shard_size, args.records))
+        for shard, start in enumerate(range(0, args.records, args.shard_size))
+        if shard not in done
+    ]
+    print(f"{len(done)} shards done, {len(shards)} to generate")
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool, \
+            open(os.path.join(args.out, 'manifest.jsonl'), 'a') as manifest:
+        futures = [
+            pool.submit(generate_shard, args.out, shard, start, stop, spec, args.seed, args.profile_memory)
+            for shard, start, stop in shards
+        ]
+        for finished, future in enumerate(as_completed(futures), start=1):
+            entry = future.result()
+            manifest.write(json.dumps(entry) + "\n")
+            manifest.flush()
+            os.fsync(manifest.fileno())
+            print(f"[{finished}/{len(shards)}] {entry['file']} records {entry['start']}-{entry['stop'] - 1}")
+
+    profile = StageProfiler.combine(entry['profile'] for entry in read_manifest(args.out).values() if 'profile' in entry)
+    with open(os.path.join(args.out, 'profile.json'), 'w') as f:
+        json.dump(profile, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""Check faster engines against golden references of the RK4 solver
+
+    python equivalence.py record --out golden.npz
+    python equivalence.py check golden.npz --set engine=vectorized
+    python equivalence.py check golden.npz --set engine=rk4 wave_tolerance=1e-4 --max-error 1e-4
+    python equivalence.py check golden.npz --set method=irfft
+
+record runs the reference pipeline (Pipeline defaults: RK4 solver, ifft RR
+synthesis, float64) with a fixed seed per case over a grid of hmean, hstd, fs
+and duration. It stores the ECG as float32, the R-peak times and the HRV metrics
+of every case, and the HRV metrics of --seeds more seeds per case, in one
+compressed npz file.
+
+check regenerates every case with the pipeline parameters given by --set on top
+of the reference ones. When only solver parameters (engine, wave_tolerance,
+precision) change, the random realization is the same, and it reports the
+largest absolute ECG error, the largest R-peak timing drift and the HRV metric
+deltas. Any other parameter changes how the RR series is drawn, e.g. method,
+domain or phase_chunk, so it compares the mean of every HRV metric over the
+stored seeds with a Welch z-score instead. It exits with status 1 if any case
+is outside the tolerances.
+"""
+import argparse
+import ast
+import itertools
+import json
+import sys
+
+import numpy as np
+
+from library.Function import Utility
+from library.Pipeline import Pipeline
+
+HMEAN = (50, 80, 120)
+HSTD = (1.0, 5.0)
+SAMPLING_RATES = (256, 512)
+DURATIONS = (10, 30)
+
+METRICS = ('SDNN', 'RMSSD', 'pNN50', 'BPM')
+
+# Parameters that only change how the ECG is solved, not the random RR series
+SOLVER_PARAMETERS = {'engine', 'wave_tolerance', 'precision'}
+
+
+def parse_overrides(pairs):
+    """name=value pairs of Pipeline parameters, values parsed as Python literals"""
+    overrides = {}
+    for pair in pairs or ():
+        name, _, value = pair.partition('=')
+        try:
+            overrides[name] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            overrides[name] = value
+    unknown = set(overrides) - set(Pipeline.DEFAULTS)
+    if unknown:
+        raise SystemExit(f"Unknown pipeline parameters: {', '.join(sorted(unknown))}")
+    return overrides
+
+
+def r_peaks(ecg, fs):
+    """R-peak times in seconds, refined between samples with a parabola through the top three"""
+    from scipy.signal import find_peaks
+
+    ecg = np.asarray(ecg, dtype=float)
+    peaks, _ = find_peaks(ecg, height=ecg.min() + 0.6 * np.ptp(ecg), distance=max(1, int(0.25 * fs)))
+    peaks = peaks[(peaks > 0) & (peaks < len(ecg) - 1)]
+
+    left, centre, right = ecg[peaks - 1], ecg[peaks], ecg[peaks + 1]
+    curvature = left - 2 * centre + right
+    offset = np.divide(0.5 * (left - right), curvature, out=np.zeros(len(peaks)), where=curvature != 0)
+    return (peaks + offset) / fs
+
+
+def run_case(case, overrides, pipeline):
+    stages = pipeline.set(**dict(case, **overrides)).run(['ecg', 'metrics'])
+    ecg = np.asarray(stages['ecg'], dtype=float)
+    return ecg, r_peaks(ecg, case['fs']), np.array([stages['metrics'][name] for name in METRICS])
+
+
+def metric_distribution(case, overrides, seeds, pipeline):
+    """HRV metrics of a case for every seed, as a (seeds, metrics) array"""
+    pipeline.set(**dict(case, **overrides))
+    return np.array([
+        [pipeline.set(seed=int(seed)).run(['metrics'])['metrics'][name] for name in METRICS]
+        for seed in seeds
+    ])
+
+
+def mean_shift(metrics, reference):
+    """Welch z-score of the difference of every metric mean from the reference
+
+    The standard error has a floor of 0.1% of the reference mean, so metrics that
+    barely vary between seeds, like BPM, still allow a small shift.
+    """
+    delta = metrics.mean(axis=0) - reference.mean(axis=0)
+    error = np.sqrt(metrics.var(axis=0, ddof=1) / len(metrics) + reference.var(axis=0, ddof=1) / len(reference))
+    error = np.maximum(error, np.maximum(1e-3 * np.abs(reference.mean(axis=0)), 1e-12))
+    return delta, np.abs(delta) / error
+
+
+def record(args):
+    base = parse_overrides(args.set)
+    grid = itertools.product(args.hmean, args.hstd, args.fs, args.duration)
+    cases = [
+        dict(base, hmean=hmean, hstd=hstd, fs=fs, duration=duration,
+             seed=int(Utility.recordSeed(args.seed, i).generate_state(1)[0]))
+        for i, (hmean, hstd, fs, duration) in enumerate(grid)
+    ]
+
+    pipeline = Pipeline()
+    arrays = {}
+    for i, case in enumerate(cases):
+        ecg, peaks, metrics = run_case(case, {}, pipeline)
+        seeds = np.array([Utility.recordSeed(args.seed, i, 1, j).generate_state(1)[0] for j in range(args.seeds)])
+        arrays[f"ecg_{i}"] = ecg.astype(np.float32)
+        arrays[f"peaks_{i}"] = peaks
+        arrays[f"metrics_{i}"] = metrics
+        arrays[f"seeds_{i}"] = seeds
+        arrays[f"distribution_{i}"] = metric_distribution(case, {}, seeds, pipeline)
+        print(f"case {i}: hmean {case['hmean']}, hstd {case['hstd']}, fs {case['fs']}, "
+              f"duration {case['duration']} s, {len(peaks)} R-peaks")
+
+    np.savez_compressed(args.out, cases=json.dumps(cases), **arrays)
+    print(f"{len(cases)} reference cases written to {args.out}")
+
+
+def check(args):
+    overrides = parse_overrides(args.set)
+    golden = np.load(args.golden)
+    cases = json.loads(str(golden['cases']))
+
+    if set(overrides) - SOLVER_PARAMETERS:
+        if 'distribution_0' not in golden:
+            raise SystemExit(f"{args.golden} has no metric distributions, record it again")
+        report = check_statistics(args, overrides, golden, cases)
+    else:
+        report = check_samples(args, overrides, golden, cases)
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'overrides': overrides, 'cases': report}, f, indent=2)
+
+    failed = sum(bool(entry['failures']) for entry in report)
+    print(f"{failed} of {len(report)} cases outside tolerance")
+    return 1 if failed else 0
+
+
+def check_statistics(args, overrides, golden, cases):
+    """Compare the HRV metric means over the stored seeds, for RR synthesis changes"""
+    pipeline = Pipeline()
+    report = []
+    for i, case in enumerate(cases):
+        reference = golden[f"distribution_{i}"]
+        metrics = metric_distribution(case, overrides, golden[f"seeds_{i}"], pipeline)
+        delta, shift = mean_shift(metrics, reference)
+
+        failures = [name for name, z in zip(METRICS, shift) if z > args.max_z]
+        report.append({
+            'case': case,
+            'mode': 'statistics',
+            'seeds': len(reference),
+            'mean_deltas': dict(zip(METRICS, delta.tolist())),
+            'z_scores': dict(zip(METRICS, shift.tolist())),
+            'failures': failures
+        })
+        print(f"case {i}: hmean {case['hmean']}, hstd {case['hstd']}, fs {case['fs']}, duration {case['duration']} s  "
+              + "  ".join(f"{name} z {z:.2f}" for name, z in zip(METRICS, shift))
+              + f"  {'FAIL ' + ', '.join(failures) if failures else 'ok'}")
+    return report
+
+
+def check_samples(args, overrides, golden, cases):
+    """Compare the ECG, R-peaks and metrics of the same realization, for solver changes"""
+    pipeline = Pipeline()
+    report = []
+    for i, case in enumerate(cases):
+        ecg, peaks, metrics = run_case(case, overrides, pipeline)
+        reference = golden[f"ecg_{i}"].astype(float)
+        reference_peaks = golden[f"peaks_{i}"]
+
+        error = float(np.max(np.abs(ecg - reference))) if len(ecg) == len(reference) else float('inf')
+        if len(peaks) == len(reference_peaks):
+            drift = float(np.max(np.abs(peaks - reference_peaks), initial=0.0)) * 1000
+        else:
+            drift = float('inf')
+        deltas = dict(zip(METRICS, (metrics - golden[f"metrics_{i}"]).tolist()))
+
+        failures = []
+        if error > args.max_error:
+            failures.append('error')
+        if drift > args.max_drift:
+            failures.append('drift')
+        if any(abs(delta) > args.max_hrv for delta in deltas.values()):
+            failures.append('hrv')
+
+        report.append({'case': case, 'mode': 'samples', 'max_error': error, 'drift_ms': drift,
+                       'hrv_deltas': deltas, 'failures': failures})
+        print(f"case {i}: hmean {case['hmean']}, hstd {case['hstd']}, fs {case['fs']}, duration {case['duration']} s  "
+              f"error {error:.2e}  drift {drift:.3f} ms  "
+              f"max HRV delta {max(abs(d) for d in deltas.values()):.2e}  {'FAIL ' + ', '.join(failures) if failures else 'ok'}")
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare ECG engines against golden RK4 references")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    record_parser = commands.add_parser('record', help="store reference outputs of the RK4 pipeline")
+    record_parser.add_argument('--out', required=True, help="golden reference npz file")
+    record_parser.add_argument('--seed', type=int, default=0, help="root seed of the case seeds")
+    record_parser.add_argument('--hmean', type=float, nargs='+', default=HMEAN, help="mean heart rates in BPM")
+    record_parser.add_argument('--hstd', type=float, nargs='+', default=HSTD, help="heart rate deviations in BPM")
+    record_parser.add_argument('--fs', type=int, nargs='+', default=SAMPLING_RATES, help="sampling frequencies in Hz")
+    record_parser.add_argument('--duration', type=float, nargs='+', default=DURATIONS, help="record lengths in seconds")
+    record_parser.add_argument('--set', nargs='+', metavar='NAME=VALUE', help="reference pipeline parameters, e.g. domain=beat")
+    record_parser.add_argument('--seeds', type=int, default=30, help="seeds per case of the HRV metric distributions")
+
+    check_parser = commands.add_parser('check', help="compare an engine with the golden references")
+    check_parser.add_argument('golden', help="golden reference npz file")
+    check_parser.add_argument('--set', nargs='+', metavar='NAME=VALUE', help="pipeline parameters under test, e.g. engine=vectorized")
+    check_parser.add_argument('--max-error', type=float, default=1e-3, help="largest absolute ECG difference (solver changes)")
+    check_parser.add_argument('--max-drift', type=float, default=2.0, help="largest R-peak drift in ms (solver changes)")
+    check_parser.add_argument('--max-hrv', type=float, default=0.1, help="largest SDNN/RMSSD (ms), pNN50 (%%) or BPM delta (solver changes)")
+    check_parser.add_argument('--max-z', type=float, default=4.0, help="largest z-score of an HRV metric mean shift (RR changes)")
+    check_parser.add_argument('--report', help="write the per case results to this JSON file")
+
+    args = parser.parse_args(argv)
+    if args.command == 'record' and args.seeds < 2:
+        parser.error("--seeds needs at least 2 seeds for a distribution")
+    if args.command == 'record':
+        record(args)
+        return 0
+    return check(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
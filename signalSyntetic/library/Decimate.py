@@ -0,0 +1,117 @@
+import numpy as np
+
+# About two points per pixel of a full-width plot
+MAX_POINTS = 4000
+
+
+def minMax(x, y, points):
+    """Keep the minimum and maximum of each of points // 2 equal index buckets
+
+    Every peak and trough survives, so QRS complexes look the same as with all
+    samples, and the first and last samples are always kept.
+    """
+    n = len(y)
+    if n <= points:
+        return x, y
+
+    size = -(-n // max(points // 2, 1))
+    rows = n // size
+    body = y[:rows * size].reshape(rows, size)
+    offsets = np.arange(rows) * size
+    indices = [body.argmin(axis=1) + offsets, body.argmax(axis=1) + offsets, [0, n - 1]]
+
+    if rows * size < n:
+        tail = y[rows * size:]
+        indices.append([rows * size + tail.argmin(), rows * size + tail.argmax()])
+
+    indices = np.unique(np.concatenate(indices))
+    return x[indices], y[indices]
+
+
+def lttb(x, y, points):
+    """Largest-Triangle-Three-Buckets, one sample per bucket picked by triangle area
+
+    Follows the shape of the signal more smoothly than minMax with half the points,
+    but only keeps the peaks that dominate their bucket.
+    """
+    n = len(y)
+    if n <= points or points < 3:
+        return x, y
+
+    edges = np.linspace(1, n - 1, points - 1).astype(int)
+    indices = np.empty(points, dtype=int)
+    indices[0], indices[-1] = 0, n - 1
+
+    selected = 0
+    for i in range(points - 2):
+        start, stop = edges[i], edges[i + 1]
+        following = slice(stop, edges[i + 2] if i + 2 < len(edges) else n)
+        mean_x, mean_y = x[following].mean(), y[following].mean()
+
+        area = np.abs((x[selected] - mean_x) * (y[start:stop] - y[selected])
+                      - (x[selected] - x[start:stop]) * (mean_y - y[selected]))
+        selected = start + area.argmax()
+        indices[i + 1] = selected
+
+    return x[indices], y[indices]
+
+
+def decimate(x, y, points=MAX_POINTS, method='minmax', xlim=None):
+    """Reduce a trace to about `points` points, optionally only the visible xlim window
+
+    x may be None for a trace over the sample index and must be increasing. Inside
+    xlim one neighbour on each side is kept so the line runs to the plot edges,
+    and a window with fewer samples than points comes back in full detail.
+    """
+    y = np.asarray(y)
+    x = np.arange(len(y)) if x is None else np.asarray(x)
+
+    if xlim is not None:
+        start = max(np.searchsorted(x, xlim[0], 'left') - 1, 0)
+        stop = min(np.searchsorted(x, xlim[1], 'right') + 1, len(x))
+        x, y = x[start:stop], y[start:stop]
+
+    if method == 'minmax':
+        return minMax(x, y, points)
+    if method == 'lttb':
+        return lttb(x, y, points)
+    raise ValueError(f"Unknown decimation method: {method}")
+
+
+class DetailLine:
+    """Keeps a matplotlib line decimated to the visible x range of its axes
+
+    The full x and y arrays stay here and the line only holds about two points
+    per pixel of the axes width. Every xlim change, from zooming, panning or an
+    explicit set_xlim, recomputes the detail of the new window.
+    """
+    def __init__(self, line, x, y, method='minmax'):
+        self.line = line
+        self.y = np.asarray(y)
+        self.x = np.arange(len(self.y)) if x is None else np.asarray(x)
+        self.method = method
+        self.update()
+        # A lambda, matplotlib only keeps weak references to bound methods
+        self.cid = line.axes.callbacks.connect('xlim_changed', lambda ax: self.update())
+
+    def setData(self, x, y):
+        """Replace the full arrays, e.g. with a longer view of a record being streamed"""
+        self.y = np.asarray(y)
+        self.x = np.arange(len(self.y)) if x is None else np.asarray(x)
+        self.update()
+
+    def update(self):
+        axes = self.line.axes
+        points = 2 * max(int(axes.bbox.width), 200)
+        xlim = sorted(axes.get_xlim()) if axes.get_autoscalex_on() is False else None
+        self.line.set_data(*decimate(self.x, self.y, points, self.method, xlim))
+
+    def remove(self):
+        self.line.axes.callbacks.disconnect(self.cid)
+
+
+def plotDetail(ax, x, y, *args, method='minmax', **kwargs):
+    """ax.plot of a long trace through a DetailLine, returns the line"""
+    line, = ax.plot(*decimate(x, y, method=method), *args, **kwargs)
+    line.detail = DetailLine(line, x, y, method)
+    return line
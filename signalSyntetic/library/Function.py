@@ -1,10 +1,14 @@
+import itertools
+import os
+import threading
+from collections import OrderedDict
+from contextlib import nullcontext
 import numpy as np
-import random
-from library.Plot import *
 
 class Function:
     @staticmethod
-    def gaussianLoop(Nrr, f1, f2, c1, c2):
+    def gaussianPower(Nrr, f1, f2, c1, c2):
+        """LF + HF Gaussian power on the positive frequency bins 1 .. Nrr//2 - 1"""
         magSf = 1.7 / Nrr
         
         # Create frequency array
@@ -13,25 +17,50 @@ class Function:
         
         S1 = magSf * np.exp(-((f - f1) ** 2) / (2 * c1 ** 2)) / np.sqrt(2 * np.pi * c1 ** 2)
         S2 = 2 * magSf * np.exp(-((f - f2) ** 2) / (2 * c2 ** 2)) / np.sqrt(2 * np.pi * c2 ** 2)
-        S_total = S1 + S2
+        return S1 + S2
+
+    @staticmethod
+    def gaussianLoop(Nrr, f1, f2, c1, c2):
+        S_total = Function.gaussianPower(Nrr, f1, f2, c1, c2)
         
         S = np.zeros(Nrr)
         S[1:Nrr//2] = S_total
-        S[Nrr//2+1:] = S[1:Nrr//2][::-1]
+        S[Nrr - (Nrr//2 - 1):] = S[1:Nrr//2][::-1]
         
         return np.sqrt(S), np.sqrt(S_total)
+
+    @staticmethod
+    def gaussianOneSided(Nrr, f1, f2, c1, c2):
+        """Magnitude of the gaussianLoop spectrum on the Nrr//2 + 1 bins irfft uses"""
+        S = np.zeros(Nrr//2 + 1)
+        S[1:Nrr//2] = Function.gaussianPower(Nrr, f1, f2, c1, c2)
+
+        return np.sqrt(S)
     
     @staticmethod
-    def randomPhase(S, N):
-        real = np.zeros(N)
-        imag = np.zeros(N)
-        
-        for n in range(N):
-            phase = 2 * np.pi * random.random()
-            real[n] = S[n] * np.cos(phase)
-            imag[n] = S[n] * np.sin(phase)
+    def randomPhase(S, N, rng=None, batch=None, chunk_size=None):
+        """Real and imaginary parts of S with a uniform random phase per bin
+
+        rng is a numpy.random.Generator or a seed for one. With batch set, returns
+        (batch, N) arrays of independent phase realizations. With chunk_size, every
+        chunk_size bins draw from their own Utility.chunkSeed stream of rng, which
+        then has to be a seed or SeedSequence, so any chunk can be regenerated or
+        drawn in parallel alone.
+        """
+        shape = () if batch is None else (batch,)
+        if chunk_size is not None and isinstance(rng, np.random.Generator):
+            raise TypeError("randomPhase with chunk_size needs a seed or SeedSequence, not a Generator")
+        if chunk_size is None:
+            rng = np.random.default_rng(rng)
+            phase = 2 * np.pi * rng.random(shape + (N,))
+        else:
+            phase = 2 * np.pi * np.concatenate([
+                np.random.default_rng(Utility.chunkSeed(rng, chunk)).random(shape + (min(chunk_size, N - start),))
+                for chunk, start in enumerate(range(0, N, chunk_size))
+            ], axis=-1)
 
-        return real.tolist(), imag.tolist()
+        S = np.asarray(S, dtype=float)[:N]
+        return S * np.cos(phase), S * np.sin(phase)
 
     @staticmethod
     def idft(re, im, N):
@@ -47,18 +76,26 @@ class Function:
         #     imag[n] /= N
         
         # return real, imag
-        result = np.fft.ifft(np.array(re) + 1j * np.array(im)) * N
-        return result.real.tolist(), result.imag.tolist()
+        result = np.fft.ifft(np.asarray(re) + 1j * np.asarray(im)) * N
+        return result.real, result.imag
+
+    @staticmethod
+    def idftReal(re, im, N):
+        """Inverse real FFT of the one-sided spectrum re + j*im (N//2 + 1 bins)
+
+        Scaled to the variance of (real + imag) * 2 from idft on the mirrored spectrum,
+        so it replaces that sum directly. Works along the last axis for batches.
+        """
+        return np.fft.irfft(np.asarray(re) + 1j * np.asarray(im), n=N) * N * 2
     
     @staticmethod
-    def derivative(t, x, y, z, params):
-        dt = params['dt']
-        rr_series = params['rr_series']
+    def derivative(t, x, y, z, params, omega=None):
         ai = params['ai']
         bi = params['bi'] 
         ti = params['ti']
         
-        omega = Utility.angfreq(t, dt, rr_series)
+        if omega is None:
+            omega = Utility.angfreq(t, params['dt'], params['rr_series'])
         
         # alpha calculation based on paper
         alpha = 1.0 - np.sqrt(x**2 + y**2)
@@ -68,13 +105,17 @@ class Function:
 
         theta = np.arctan2(y, x)
 
-        z_sum = 0
-        for i in range(len(ai)):
-            delta_theta = (theta - ti[i]) % (2 * np.pi)
-            if delta_theta > np.pi:
-                delta_theta -= 2 * np.pi
-            
-            z_sum += ai[i] * delta_theta * np.exp(-0.5 * (delta_theta**2) / (bi[i]**2))
+        table = params.get('wave_table')
+        if table is not None:
+            z_sum = table.at(theta)
+        else:
+            z_sum = 0
+            for i in range(len(ai)):
+                delta_theta = (theta - ti[i]) % (2 * np.pi)
+                if delta_theta > np.pi:
+                    delta_theta -= 2 * np.pi
+
+                z_sum += ai[i] * delta_theta * np.exp(-0.5 * (delta_theta**2) / (bi[i]**2))
         
         # Respiratory baseline wandering
         f_resp = 0.3  # Respiratory frequency (Hz)
@@ -86,31 +127,54 @@ class Function:
 
     @staticmethod
     def solveEcgModel(dt, Nrr, params):
-        """Solve the ECG dynamical model using Runge Kutta order 4"""
+        """Solve the ECG dynamical model using Runge Kutta order 4
+
+        params may carry a precomputed 'omega' array from Utility.omegaSeries,
+        otherwise it is built once from 'rr_series' with angfreq semantics. With a
+        'wave_table' from waveTable the P, Q, R, S, T sum is read from the table
+        instead of evaluated.
+        """
+        omega = params.get('omega')
+        if omega is None:
+            omega = Utility.omegaSeries(params['rr_series'], dt, Nrr)
+
         # Initial conditions
         x = [1.0, 0.0, 0.04]  # Start on the limit cycle
-        
-        # Storage arrays
-        xt = []
-        yt = []
-        zt = []
-        
         t = 0.0
-        
-        for i in range(Nrr):
-            xt.append(x[0])
-            yt.append(x[1])
-            zt.append(x[2])
-            
+
+        # Blocks of steps, so the Python lists integrateSteps iterates stay small
+        omega = np.asarray(omega, dtype=float)
+        zt = np.empty(omega.shape[-1])
+        for start in range(0, len(zt), 4096):
+            zt[start:start + 4096], t = Function.integrateSteps(x, t, dt, omega[:, start:start + 4096], params)
+
+        return zt
+
+    @staticmethod
+    def integrateSteps(x, t, dt, omega, params):
+        """Runge Kutta order 4 steps of solveEcgModel from state x at time t
+
+        omega is a (3, n) stage array for the n steps. x is updated in place and the
+        z samples are returned as an array with the time after the last step, so that
+        calls can be chained chunk by chunk with the same result as one long solve.
+        """
+        omega = np.asarray(omega, dtype=float)
+        zt = np.empty(omega.shape[-1])
+        params = Function.scalarParams(params)
+
+        for i, (omega_start, omega_mid, omega_end) in enumerate(omega.T.tolist()):
+            zt[i] = x[2]
+
             # Runge-Kutta 4th order
-            k1 = Function.derivative(t, x[0], x[1], x[2], params)
+            k1 = Function.derivative(t, x[0], x[1], x[2], params, omega_start)
             
             k2 = Function.derivative(
                 t + dt/2, 
                 x[0] + dt*k1[0]/2, 
                 x[1] + dt*k1[1]/2, 
                 x[2] + dt*k1[2]/2, 
-                params
+                params,
+                omega_mid
             )
             
             k3 = Function.derivative(
@@ -118,7 +182,8 @@ class Function:
                 x[0] + dt*k2[0]/2,
                 x[1] + dt*k2[1]/2,
                 x[2] + dt*k2[2]/2,
-                params
+                params,
+                omega_mid
             )
             
             k4 = Function.derivative(
@@ -126,7 +191,8 @@ class Function:
                 x[0] + dt*k3[0],
                 x[1] + dt*k3[1], 
                 x[2] + dt*k3[2],
-                params
+                params,
+                omega_end
             )
             
             # Update state variables
@@ -135,15 +201,491 @@ class Function:
             x[2] += dt * (k1[2] + 2*k2[2] + 2*k3[2] + k4[2]) / 6
             
             t += dt
-        
+
+        return zt, t
+
+    @staticmethod
+    def scalarParams(params):
+        """params with ai, bi and ti as Python lists for the per-wave loop of derivative
+
+        Morphology hands out ndarrays, which suit the batch and vectorized engines,
+        but float arithmetic on list items is faster than on NumPy scalars.
+        """
+        return dict(params, **{key: np.asarray(params[key], dtype=float).tolist()
+                               for key in ('ai', 'bi', 'ti') if key in params})
+
+    @staticmethod
+    def derivativeBatch(t, x, y, z, params, omega=None):
+        """derivative for a batch of records, x, y and z are arrays of shape (batch,)"""
+        ai = params['ai']
+        bi = params['bi']
+        ti = params['ti']
+
+        if omega is None:
+            # Every record shares the time axis, so the RR index is the same for all of them
+            rr_series = params['rr_series']
+            omega = 2.0 * np.pi / rr_series[:, int(t / params['dt']) % rr_series.shape[1]]
+
+        alpha = 1.0 - np.sqrt(x**2 + y**2)
+
+        dx = alpha * x - omega * y
+        dy = alpha * y + omega * x
+
+        theta = np.arctan2(y, x)
+
+        table = params.get('wave_table')
+        if table is not None:
+            z_sum = table(theta)
+        else:
+            z_sum = 0
+            for i in range(ai.shape[1]):
+                delta_theta = (theta - ti[:, i]) % (2 * np.pi)
+                delta_theta = np.where(delta_theta > np.pi, delta_theta - 2 * np.pi, delta_theta)
+
+                z_sum += ai[:, i] * delta_theta * np.exp(-0.5 * (delta_theta**2) / (bi[:, i]**2))
+
+        # Respiratory baseline wandering
+        f_resp = 0.3  # Respiratory frequency (Hz)
+        z_baseline = 0.005 * np.sin(2 * np.pi * f_resp * t)
+
+        dz = -z_sum - (z - z_baseline)
+
+        return dx, dy, dz
+
+    @staticmethod
+    def solveEcgBatch(dt, Nrr, params):
+        """Solve the ECG dynamical model for many records at once using Runge Kutta order 4
+
+        params holds 'rr_series' of shape (batch, L) and 'ai', 'bi', 'ti' of shape
+        (batch, 5) or (5,) when all records share one morphology. A precomputed
+        'omega' of shape (3, batch, Nrr) may replace 'rr_series', and a 'wave_table'
+        may be given when the morphology is shared. Returns a
+        (batch, Nrr) array, row b matching solveEcgModel on record b.
+        """
+        omega = params.get('omega')
+        if omega is None:
+            rr_series = np.atleast_2d(np.asarray(params['rr_series'], dtype=float))
+            omega = Utility.omegaSeries(rr_series, dt, Nrr)
+        omega = np.asarray(omega, dtype=float)
+        batch = omega.shape[1]
+        # Step-major layout so each step reads one contiguous (3, batch) block
+        omega = np.ascontiguousarray(np.moveaxis(omega, -1, 0))
+
+        def per_record(values):
+            values = np.asarray(values, dtype=float)
+            return np.broadcast_to(values, (batch, values.shape[-1]))
+
+        batch_params = {
+            'ai': per_record(params['ai']),
+            'bi': per_record(params['bi']),
+            'ti': per_record(params['ti']),
+            'wave_table': params.get('wave_table')
+        }
+
+        # Initial conditions, every record starts on the limit cycle
+        x = np.full(batch, 1.0)
+        y = np.full(batch, 0.0)
+        z = np.full(batch, 0.04)
+
+        zt = np.empty((batch, Nrr))
+
+        t = 0.0
+
+        for i in range(Nrr):
+            zt[:, i] = z
+
+            omega_start, omega_mid, omega_end = omega[i]
+
+            # Runge-Kutta 4th order
+            k1 = Function.derivativeBatch(t, x, y, z, batch_params, omega_start)
+
+            k2 = Function.derivativeBatch(
+                t + dt/2,
+                x + dt*k1[0]/2,
+                y + dt*k1[1]/2,
+                z + dt*k1[2]/2,
+                batch_params,
+                omega_mid
+            )
+
+            k3 = Function.derivativeBatch(
+                t + dt/2,
+                x + dt*k2[0]/2,
+                y + dt*k2[1]/2,
+                z + dt*k2[2]/2,
+                batch_params,
+                omega_mid
+            )
+
+            k4 = Function.derivativeBatch(
+                t + dt,
+                x + dt*k3[0],
+                y + dt*k3[1],
+                z + dt*k3[2],
+                batch_params,
+                omega_end
+            )
+
+            # Update state variables
+            x = x + dt * (k1[0] + 2*k2[0] + 2*k3[0] + k4[0]) / 6
+            y = y + dt * (k1[1] + 2*k2[1] + 2*k3[1] + k4[1]) / 6
+            z = z + dt * (k1[2] + 2*k2[2] + 2*k3[2] + k4[2]) / 6
+
+            t += dt
+
+        return zt
+
+    @staticmethod
+    def waveSum(theta, ai, bi, ti):
+        """Gaussian P, Q, R, S, T event sum of derivative for an array of phases"""
+        theta = np.asarray(theta, dtype=float)
+        ai = np.asarray(ai, dtype=float)
+        bi = np.asarray(bi, dtype=float)
+        ti = np.asarray(ti, dtype=float)
+
+        z_sum = np.zeros(np.broadcast(theta, ai[..., 0]).shape)
+        for i in range(ai.shape[-1]):
+            # Wrap to [-pi, pi] with rint, which is much cheaper than np.mod on large arrays
+            delta_theta = theta - ti[..., i]
+            delta_theta -= 2 * np.pi * np.rint(delta_theta / (2 * np.pi))
+
+            # Clamping the exponent keeps exp out of its slow subnormal range (exp(-700) ~ 1e-304)
+            term = delta_theta**2
+            term *= -0.5 / bi[..., i]**2
+            np.maximum(term, -700.0, out=term)
+            np.exp(term, out=term)
+            term *= delta_theta
+            term *= ai[..., i]
+            z_sum += term
+
+        return z_sum
+
+    @staticmethod
+    def solveEcgVectorized(dt, Nrr, params):
+        """Solve the ECG dynamical model with array operations instead of a per-sample loop
+
+        The (x, y) trajectory stays on the unit limit cycle, so each RK4 step is a
+        rotation that only depends on the angular frequencies it reads. The phase is
+        the cumulative sum of those rotations, and z is the RK4 update of the linear
+        system dz = u(t) - z, which reduces to a first order recursive filter.
+        """
+        omega = params.get('omega')
+        if omega is None:
+            # Stage omegas are built per block below, with the same indices as omegaSeries
+            omega_rr = 2.0 * np.pi / np.asarray(params['rr_series'], dtype=float)
+        else:
+            omega = np.asarray(omega, dtype=float)
+
+        zt = np.empty(Nrr)
+        t, theta, z = 0.0, 0.0, 0.04
+
+        # Blocks of steps bound the stage arrays, phase, z and time carry over
+        for start in range(0, Nrr, 65536):
+            n = min(65536, Nrr - start)
+            # Same time accumulation as solveEcgModel
+            t_steps = Utility.stepTimes(dt, n, t)
+            if omega is None:
+                block = omega_rr[np.stack(Utility.stageIndices(t_steps, dt)) % len(omega_rr)]
+            else:
+                block = omega[:, start:start + n]
+
+            zt[start:start + n], theta, z = Function.integrateVectorized(t_steps, dt, block, params, theta, z)
+            t = t_steps[-1] + dt
+
         return zt
 
+    @staticmethod
+    def limitCycleStep(dt, omega):
+        """One RK4 step of (x, y) from (1, 0) for every column of a (3, n) omega array
+
+        On the limit cycle a step is a rotation, returns its angle and the angles of
+        the k2, k3 and k4 stage points relative to the start of the step.
+        """
+        omega1, omega2, omega4 = np.asarray(omega, dtype=float)
+
+        def rotation(x, y, omega):
+            alpha = 1.0 - np.sqrt(x**2 + y**2)
+            return alpha * x - omega * y, alpha * y + omega * x
+
+        k1 = rotation(1.0, 0.0, omega1)
+        p2 = (1.0 + dt*k1[0]/2, dt*k1[1]/2)
+        k2 = rotation(p2[0], p2[1], omega2)
+        p3 = (1.0 + dt*k2[0]/2, dt*k2[1]/2)
+        k3 = rotation(p3[0], p3[1], omega2)
+        p4 = (1.0 + dt*k3[0], dt*k3[1])
+        k4 = rotation(p4[0], p4[1], omega4)
+        x_next = 1.0 + dt * (k1[0] + 2*k2[0] + 2*k3[0] + k4[0]) / 6
+        y_next = dt * (k1[1] + 2*k2[1] + 2*k3[1] + k4[1]) / 6
+
+        offsets = (np.arctan2(p2[1], p2[0]), np.arctan2(p3[1], p3[0]), np.arctan2(p4[1], p4[0]))
+        return np.arctan2(y_next, x_next), offsets
+
+    @staticmethod
+    def integrateVectorized(t, dt, omega, params, theta0, z0):
+        """Closed form steps of solveEcgVectorized at step times t from phase theta0 and z0
+
+        Returns the z samples with the phase and z after the last step, so that calls
+        can be chained chunk by chunk with the same result as one long solve.
+        """
+        from scipy.signal import lfilter
+
+        if len(t) == 0:
+            return np.empty(0), theta0, z0
+
+        ai = params.get('ai')
+        bi = params.get('bi')
+        ti = params.get('ti')
+
+        increment, (offset2, offset3, offset4) = Function.limitCycleStep(dt, omega)
+
+        theta = np.cumsum(np.concatenate(([theta0], increment)))
+        theta, theta_last = theta[:-1], theta[-1]
+
+        # Forcing u = z_baseline - z_sum at each RK4 stage
+        f_resp = 0.3
+        baseline = 0.005 * np.sin(2 * np.pi * f_resp * t)
+        baseline_half = 0.005 * np.sin(2 * np.pi * f_resp * (t + dt/2))
+        baseline_next = 0.005 * np.sin(2 * np.pi * f_resp * (t + dt))
+
+        table = params.get('wave_table')
+        if table is not None:
+            wave_sum = table
+        else:
+            def wave_sum(phase):
+                return Function.waveSum(phase, ai, bi, ti)
+
+        u1 = baseline - wave_sum(theta)
+        u2 = baseline_half - wave_sum(theta + offset2)
+        u3 = baseline_half - wave_sum(theta + offset3)
+        u4 = baseline_next - wave_sum(theta + offset4)
+
+        # RK4 applied to dz = u - z is z[n+1] = a*z[n] + b[n]
+        h = dt
+        a = 1 - h + h**2/2 - h**3/6 + h**4/24
+        b = h / 6 * (u1 * (1 - h + h**2/2 - h**3/4)
+                     + u2 * (2 - h + h**2/2)
+                     + u3 * (2 - h)
+                     + u4)
+
+        z_next, _ = lfilter([1.0], [1.0, -a], b, zi=[a * z0])
+
+        return np.concatenate(([z0], z_next[:-1])), theta_last, z_next[-1]
+
+    @staticmethod
+    def streamEcgModel(dt, rr_iter, params, chunk_size=4096, Nrr=None, engine='rk4'):
+        """Yield the ECG of a one-shot solve as NumPy chunks of chunk_size samples
+
+        rr_iter supplies the per-sample RR series lazily and only about one chunk of
+        it is held at a time, so memory does not grow with the record length. The
+        integrator state and time carry over between chunks, making the joined chunks
+        identical to solveEcgModel ('rk4') or solveEcgVectorized ('vectorized') on the
+        full series. Without Nrr the stream ends with the RR iterator.
+        """
+        if engine not in ('rk4', 'vectorized'):
+            raise ValueError(f"Unknown engine: {engine}")
+
+        rr_iter = iter(rr_iter)
+        rr_buffer = np.fromiter(itertools.islice(rr_iter, chunk_size + 2), dtype=float)
+        if len(rr_buffer) == 0:
+            return
+
+        omega_first = 2.0 * np.pi / rr_buffer[0]
+        rr_offset = 0      # absolute RR index of rr_buffer[0]
+        rr_count = None    # total RR length, known once rr_iter is exhausted
+
+        x = [1.0, 0.0, 0.04]
+        theta, z = 0.0, 0.04
+        t = 0.0
+        done = 0
+
+        while True:
+            # Stages of this chunk read up to one RR index past its last step
+            needed = done + chunk_size + 2 - rr_offset
+            if rr_count is None and len(rr_buffer) < needed:
+                more = np.fromiter(itertools.islice(rr_iter, needed - len(rr_buffer)), dtype=float)
+                rr_buffer = np.concatenate((rr_buffer, more))
+                if len(rr_buffer) < needed:
+                    rr_count = rr_offset + len(rr_buffer)
+
+            total = Nrr if Nrr is not None else rr_count
+            n = chunk_size if total is None else min(chunk_size, total - done)
+            if n <= 0:
+                return
+
+            t_steps = Utility.stepTimes(dt, n, t)
+            indices = np.stack(Utility.stageIndices(t_steps, dt))
+            if rr_count is not None:
+                # Same wrap as angfreq, only the first RR value is still available
+                indices %= rr_count
+                wrapped = indices < rr_offset
+                if np.any(indices[wrapped] != 0):
+                    raise ValueError("RR iterator is shorter than the requested number of samples")
+                omega = np.where(wrapped, omega_first,
+                                 2.0 * np.pi / rr_buffer[np.maximum(indices - rr_offset, 0)])
+            else:
+                omega = 2.0 * np.pi / rr_buffer[indices - rr_offset]
+
+            if engine == 'rk4':
+                chunk, t = Function.integrateSteps(x, t, dt, omega, params)
+            else:
+                chunk, theta, z = Function.integrateVectorized(t_steps, dt, omega, params, theta, z)
+                t = t_steps[-1] + dt
+
+            done += n
+            yield chunk
+
+            # Keep one RR sample before the next step, its stage times may floor onto it
+            drop = max(done - 1 - rr_offset, 0)
+            rr_buffer = rr_buffer[drop:]
+            rr_offset += drop
+
+    @staticmethod
+    def solveEcgAdaptive(dt, Nrr, params, fs_out=None, rtol=1e-6, atol=1e-8):
+        """Solve the ECG dynamical model with adaptive step Runge Kutta 4(5)
+
+        The embedded error estimate takes long steps through the isoelectric and T
+        wave segments and short ones through the QRS complex, and dense output
+        samples the solution on the fs_out grid (1/dt by default) over Nrr * dt
+        seconds. omega is interpolated linearly between RR samples so the right hand
+        side is continuous. This only pays off for a smooth per-sample RR series,
+        such as a beat-domain tachogram through Utility.sampleRR; see README for
+        accuracy and speed against solveEcgModel.
+        """
+        from scipy.integrate import solve_ivp
+
+        params = Function.scalarParams(params)
+        omega_rr = 2.0 * np.pi / np.asarray(params['rr_series'], dtype=float)
+        length = len(omega_rr)
+
+        def omega_at(t):
+            position = t / dt
+            index = int(position)
+            fraction = position - index
+            return omega_rr[index % length] * (1 - fraction) + omega_rr[(index + 1) % length] * fraction
+
+        def rhs(t, state):
+            return Function.derivative(t, state[0], state[1], state[2], params, omega_at(t))
+
+        duration = Nrr * dt
+        solution = solve_ivp(rhs, (0.0, duration), [1.0, 0.0, 0.04], method='RK45',
+                             rtol=rtol, atol=atol, dense_output=True)
+
+        fs_out = fs_out or 1 / dt
+        samples = int(round(duration * fs_out))
+        return solution.sol(np.arange(samples) / fs_out)[2]
+
+    @staticmethod
+    def solveEcgParallel(dt, Nrr, params, segments=None, overlap=20.0, workers=None, tolerance=1e-6, engine='rk4'):
+        """Solve one long record as time segments in a process pool
+
+        A cheap sequential pass sums the limit-cycle phase up to every segment, so each
+        segment starts on the cycle at its known phase. z is unknown there, so every
+        segment starts overlap seconds early and the z error decays as exp(-t) before
+        its first kept sample. The seam error is the difference between neighbouring
+        segments on the last overlapped sample; segments whose seam exceeds tolerance
+        are solved again with twice the overlap. Returns (zt, report).
+        """
+        from concurrent.futures import ProcessPoolExecutor
+
+        if Nrr == 0:
+            return np.empty(0), {'segments': 0, 'overlap': [], 'seam_errors': [], 'max_error': 0.0}
+
+        workers = workers or os.cpu_count()
+        segments = min(segments or workers, Nrr)
+        rr_series = np.asarray(params['rr_series'], dtype=float)
+        # A wave table goes to the workers too, so segments match the serial engines
+        morphology = {key: params[key] for key in ('ai', 'bi', 'ti', 'wave_table') if key in params}
+        bounds = np.linspace(0, Nrr, segments + 1).astype(int)
+        block = 1 << 20
+
+        def phase_marks(indices):
+            # Step time and limit-cycle phase at each step index, in bounded blocks
+            marks = {}
+            t, theta, step = 0.0, 0.0, 0
+            for stop in sorted(set(indices)):
+                while step < stop:
+                    n = min(stop - step, block)
+                    t_steps = Utility.stepTimes(dt, n, t)
+                    increment, _ = Function.limitCycleStep(dt, Utility.omegaAt(rr_series, t_steps, dt))
+                    theta = np.cumsum(np.concatenate(([theta], increment)))[-1]
+                    t = t_steps[-1] + dt
+                    step += n
+                marks[stop] = (t, theta)
+            return marks
+
+        def seam_errors(solutions):
+            errors = []
+            for k in range(1, segments):
+                seam = bounds[k] - 1
+                (a_prev, z_prev), (a, z) = solutions[k - 1], solutions[k]
+                errors.append(float(abs(z[seam - a] - z_prev[seam - a_prev])) if seam >= a else np.inf)
+            return errors
+
+        warmups = [max(int(round(overlap / dt)), 1)] * segments
+        solutions = [None] * segments
+        pending = list(range(segments))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            while pending:
+                starts = {k: max(bounds[k] - warmups[k], 0) for k in pending}
+                marks = phase_marks(starts.values())
+
+                futures = {}
+                for k, a in starts.items():
+                    t, theta = marks[a]
+                    n = bounds[k + 1] - a
+                    # RR values for every stage index of the segment, one past each end
+                    window = rr_series[np.arange(a - 1, a + n + 2) % len(rr_series)]
+                    z0 = 0.04 if a == 0 else 0.0
+                    futures[k] = pool.submit(Function.solveSegment, t, theta, z0, n, dt, window, a - 1, morphology, engine)
+                for k, future in futures.items():
+                    solutions[k] = (starts[k], future.result())
+
+                errors = seam_errors(solutions)
+                pending = []
+                for k, error in enumerate(errors, start=1):
+                    if error > tolerance and bounds[k] - warmups[k] > 0:
+                        warmups[k] *= 2
+                        pending.append(k)
+
+        zt = np.empty(Nrr)
+        for k, (a, z) in enumerate(solutions):
+            zt[bounds[k]:bounds[k + 1]] = z[bounds[k] - a:]
+
+        report = {
+            'segments': segments,
+            'overlap': [warmup * dt for warmup in warmups],
+            'seam_errors': errors,
+            'max_error': max(errors, default=0.0)
+        }
+        return zt, report
+
+    @staticmethod
+    def solveSegment(t0, theta0, z0, n, dt, rr_window, window_start, params, engine='rk4'):
+        """Worker of solveEcgParallel, n steps from phase theta0 and z0 at time t0
+
+        rr_window holds the RR values from absolute index window_start onwards.
+        """
+        t = Utility.stepTimes(dt, n, t0)
+        indices = np.stack(Utility.stageIndices(t, dt)) - window_start
+        omega = 2.0 * np.pi / np.asarray(rr_window, dtype=float)[indices]
+
+        if engine == 'vectorized':
+            zt, _, _ = Function.integrateVectorized(t, dt, omega, params, theta0, z0)
+            return zt
+        if engine == 'rk4':
+            zt, _ = Function.integrateSteps([np.cos(theta0), np.sin(theta0), z0], t0, dt, omega, params)
+            return zt
+        raise ValueError(f"Unknown engine: {engine}")
+
 
 class Utility:
     @staticmethod
     def scaling(s, hmean, hstd=1):
-        """Scale RR intervals to have correct mean heart rate and standard deviation"""
-        s = np.array(s)
+        """Scale RR intervals to have correct mean heart rate and standard deviation
+
+        Returns an array of the dtype of s, so a float32 series stays float32.
+        """
+        s = np.asarray(s)
         
         # Convert heart rate std to RR interval std
         rr_mean = 60.0 / hmean
@@ -153,9 +695,9 @@ class Utility:
         rr_intervals = s * rr_std + rr_mean
         
         # Ensure positive values (minimum RR = 0.3s for safety)
-        rr_intervals = np.maximum(rr_intervals, 0.3)
+        rr_intervals = np.maximum(rr_intervals, 0.3, out=rr_intervals)
         
-        return rr_intervals.tolist()
+        return rr_intervals
     
     @staticmethod
     def doubleFactorial(hr):
@@ -169,15 +711,101 @@ class Utility:
     @staticmethod
     def normalize(data):
         """Normalize data to [0, 1] range"""
-        data = np.array(data)
+        data = np.asarray(data)
         min_val = np.min(data)
         max_val = np.max(data)
         
         if max_val - min_val == 0:
-            return np.ones_like(data).tolist()
+            return np.ones_like(data)
         
-        normalized = (data - min_val) / (max_val - min_val)
-        return normalized.tolist()
+        return (data - min_val) / (max_val - min_val)
+
+    @staticmethod
+    def recordSeed(root_seed, record_id, *stream):
+        """Independent SeedSequence of one record, or of a sub-stream of it
+
+        This is the child SeedSequence(root_seed).spawn() hands out for record_id
+        (and further spawn levels for stream), so a single record can be regenerated
+        without replaying the records before it, in any process or on any machine.
+        """
+        return np.random.SeedSequence(root_seed, spawn_key=(record_id,) + stream)
+
+    @staticmethod
+    def chunkSeed(seed, chunk):
+        """Independent SeedSequence for chunk number chunk of the stream seed"""
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        return np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key + (chunk,))
+
+    @staticmethod
+    def stepTimes(dt, Nrr, t0=0.0):
+        """Start time of every solver step from t0, accumulated exactly like t += dt"""
+        steps = np.full(Nrr, dt)
+        steps[:1] = t0
+        return np.cumsum(steps)
+
+    @staticmethod
+    def stageIndices(t, dt):
+        """RR index angfreq reads at the t, t + dt/2 and t + dt stages of each step time"""
+        return (t / dt).astype(int), ((t + dt/2) / dt).astype(int), ((t + dt) / dt).astype(int)
+
+    @staticmethod
+    def omegaSeries(rr_series, dt, Nrr, interpolation='hold'):
+        """Angular frequency read by each RK4 stage of every step, as a (3, ..., Nrr) array
+
+        Rows are the t, t + dt/2 and t + dt stages. 'hold' reproduces angfreq, each
+        stage reading the RR interval at int(stage_time / dt). 'linear' takes the
+        midpoint stages halfway to the next RR sample and the end stage on it.
+        """
+        omega_rr = 2.0 * np.pi / np.asarray(rr_series, dtype=float)
+        length = omega_rr.shape[-1]
+
+        index_start, index_mid, index_end = Utility.stageIndices(Utility.stepTimes(dt, Nrr), dt)
+        omega_start = omega_rr[..., index_start % length]
+
+        if interpolation == 'hold':
+            omega_mid = omega_rr[..., index_mid % length]
+            omega_end = omega_rr[..., index_end % length]
+        elif interpolation == 'linear':
+            omega_end = omega_rr[..., (index_start + 1) % length]
+            omega_mid = 0.5 * (omega_start + omega_end)
+        else:
+            raise ValueError(f"Unknown omega interpolation: {interpolation}")
+
+        return np.stack((omega_start, omega_mid, omega_end))
+
+    @staticmethod
+    def beatCount(duration, hmean):
+        """Number of beats for a beat-domain RR series covering duration at hmean BPM"""
+        # 10% margin so slower stretches of the tachogram still cover the record
+        return int(np.ceil(duration * hmean / 60.0 * 1.1)) + 2
+
+    @staticmethod
+    def beatSynthesisLength(beats, minimum=256):
+        """RR synthesis length of a beat-domain series, at least minimum beats
+
+        On a short tachogram the c = 0.01 LF/HF Gaussians are narrower than the
+        1/beats bin spacing and catch a random share of their power, so the series
+        is synthesized this long and truncated to the beats that are used.
+        """
+        return max(beats, minimum)
+
+    @staticmethod
+    def sampleRR(rr_beats, fs, Nrr):
+        """Interpolate a beat-domain RR series onto the Nrr ECG samples at fs
+
+        Each beat starts where the previous ones end, and the RR value is linearly
+        interpolated between beat onsets, giving the per-sample series the solvers read.
+        """
+        rr_beats = np.asarray(rr_beats, dtype=float)
+        beat_onsets = np.concatenate(([0.0], np.cumsum(rr_beats[:-1])))
+        return np.interp(np.arange(Nrr) / fs, beat_onsets, rr_beats)
+
+    @staticmethod
+    def omegaAt(rr_series, t, dt):
+        """omegaSeries 'hold' values for arbitrary step times t, as a (3, len(t)) array"""
+        indices = np.stack(Utility.stageIndices(t, dt)) % len(rr_series)
+        return 2.0 * np.pi / np.asarray(rr_series, dtype=float)[indices]
 
     @staticmethod
     def angfreq(t, dt, rr_series):
@@ -217,30 +845,221 @@ class Utility:
         pnn50 = np.sum(np.abs(diff) > 50.0) / len(diff) * 100.0  # 50ms threshold
         return pnn50
     
+
+
+class SpectrumCache:
+    """Bounded LRU cache of Gaussian LF/HF spectra keyed by (Nrr, f1, f2, c1, c2)
+
+    Entries are evicted least recently used first once their arrays exceed
+    max_bytes. Cached arrays are read-only, so every caller shares one copy.
+    """
+    def __init__(self, max_bytes=256 * 1024**2):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def gaussianLoop(self, Nrr, f1, f2, c1, c2):
+        """Cached Function.gaussianLoop"""
+        return self._get(('loop', Nrr, f1, f2, c1, c2), Function.gaussianLoop)
+
+    def gaussianOneSided(self, Nrr, f1, f2, c1, c2):
+        """Cached Function.gaussianOneSided"""
+        return self._get(('onesided', Nrr, f1, f2, c1, c2), Function.gaussianOneSided)
+
+    def info(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._entries),
+            'nbytes': self.nbytes,
+            'max_bytes': self.max_bytes
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def _get(self, key, compute):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+
+        value = compute(*key[1:])
+        arrays = value if isinstance(value, tuple) else (value,)
+        for array in arrays:
+            array.setflags(write=False)
+        size = sum(array.nbytes for array in arrays)
+
+        if size <= self.max_bytes:
+            with self._lock:
+                if key not in self._entries:
+                    self._entries[key] = (value, size)
+                    self.nbytes += size
+                while self.nbytes > self.max_bytes:
+                    _, (_, evicted) = self._entries.popitem(last=False)
+                    self.nbytes -= evicted
+
+        return value
+
+
+spectrumCache = SpectrumCache()
+
+
+class WaveTable:
+    """Periodic lookup table of Function.waveSum over theta in [-pi, pi]
+
+    For fixed ai, bi and ti the Gaussian event sum only depends on theta, so it is
+    sampled once on `size` points and read back with linear interpolation. Calling
+    the table works on arrays, at() is the faster form for a single float.
+    """
+    def __init__(self, ai, bi, ti, size=4096):
+        self.size = size
+        self.scale = size / (2 * np.pi)
+        grid = np.arange(size + 2) / self.scale - np.pi
+        self.values = Function.waveSum(grid, ai, bi, ti)
+        self.values.setflags(write=False)
+        # Python floats index faster than NumPy scalars in the per-step RK4 loop
+        self._list = self.values.tolist()
+
+    def __call__(self, theta):
+        theta = np.asarray(theta, dtype=float)
+        delta_theta = theta - 2 * np.pi * np.rint(theta / (2 * np.pi))
+        position = (delta_theta + np.pi) * self.scale
+        index = np.minimum(position.astype(int), self.size)
+        fraction = position - index
+        return self.values[index] + fraction * (self.values[index + 1] - self.values[index])
+
+    def at(self, theta):
+        """Table value at one theta from np.arctan2, i.e. already in [-pi, pi]"""
+        position = (theta + np.pi) * self.scale
+        index = int(position)
+        fraction = position - index
+        lower = self._list[index]
+        return lower + fraction * (self._list[index + 1] - lower)
+
+    def error(self, ai, bi, ti):
+        """Largest interpolation error, found half way between table points"""
+        midpoints = (np.arange(self.size) + 0.5) / self.scale - np.pi
+        return float(np.max(np.abs(self(midpoints) - Function.waveSum(midpoints, ai, bi, ti))))
+
+
+_waveTables = OrderedDict()
+_waveTablesLock = threading.Lock()
+
+
+def waveTable(ai, bi, ti, tolerance=1e-4, max_tables=32):
+    """Shared WaveTable of a morphology with interpolation error below tolerance
+
+    The table size doubles from 1024 points until the error between points is
+    within tolerance (at most 2**22 points). Tables are kept per (ai, bi, ti,
+    tolerance), so every stage, chunk and record with the same morphology reads
+    the same table.
+    """
+    key = (tuple(np.asarray(ai, dtype=float).tolist()),
+           tuple(np.asarray(bi, dtype=float).tolist()),
+           tuple(np.asarray(ti, dtype=float).tolist()),
+           tolerance)
+    with _waveTablesLock:
+        if key in _waveTables:
+            _waveTables.move_to_end(key)
+            return _waveTables[key]
+
+    size = 1024
+    table = WaveTable(ai, bi, ti, size)
+    while table.error(ai, bi, ti) > tolerance and size < 2**22:
+        size *= 2
+        table = WaveTable(ai, bi, ti, size)
+
+    with _waveTablesLock:
+        _waveTables[key] = table
+        while len(_waveTables) > max_tables:
+            _waveTables.popitem(last=False)
+    return table
+
     
-def generate(f1, f2, c1, c2, duration, hmean, fs, hstd=None):  # Add verbose flag
-    """Optimized generate function"""
-    Nrr = int(duration * fs)
-    print(f"Nrr: {Nrr}")
+def generateStages(f1, f2, c1, c2, duration, hmean, fs, hstd=None, domain='sample', seed=None, method='ifft', profiler=None):
+    """Headless RR pipeline, returns every intermediate array in a dict
+
+    domain='sample' synthesizes one RR value per ECG sample. domain='beat' synthesizes
+    one RR value per heartbeat, sized from duration and hmean, so the metrics are taken
+    on beat-to-beat intervals; pass the result through Utility.sampleRR for the solver.
+    Beat series are synthesized over at least Utility.beatSynthesisLength beats and
+    truncated, and Nrr in the result is that synthesis length.
+    seed (an int or numpy.random.Generator) makes the random phases reproducible.
+    method='irfft' synthesizes from the one-sided spectrum with a real inverse FFT,
+    same spectral statistics as 'ifft' for about half the FFT work and memory.
+    A library.Profile.StageProfiler records the time and memory of every step.
+    """
+    def stage(name):
+        return profiler.stage(name) if profiler is not None else nullcontext()
+
+    if domain == 'sample':
+        Nrr = length = int(duration * fs)
+    elif domain == 'beat':
+        length = Utility.beatCount(duration, hmean)
+        Nrr = Utility.beatSynthesisLength(length)
+    else:
+        raise ValueError(f"Unknown RR domain: {domain}")
     
     # Pre-compute base spectrum once
-    Sw_base, _ = Function.gaussianLoop(Nrr, f1, f2, c1, c2)
-    singlePlot(Sw_base, title='Base Power Spectrum', xlabel='Frequency Bin', ylabel='Magnitude')
+    with stage('spectrum'):
+        if method == 'ifft':
+            Sw_base, _ = spectrumCache.gaussianLoop(Nrr, f1, f2, c1, c2)
+        elif method == 'irfft':
+            Sw_base = spectrumCache.gaussianOneSided(Nrr, f1, f2, c1, c2)
+        else:
+            raise ValueError(f"Unknown RR synthesis method: {method}")
 
     # Use optimized functions
-    real_0, imag_0 = Function.randomPhase(Sw_base, Nrr)
-    combine2Plot(real_0, imag_0, title='Random Phase Components', label1='Real Part', label2='Imaginary Part')
-    real, imag = Function.idft(real_0, imag_0, Nrr)
+    with stage('phase'):
+        real_0, imag_0 = Function.randomPhase(Sw_base, len(Sw_base), seed)
     
     # Combine operations
-    S = (real + imag) * 2
+    with stage('unit'):
+        if method == 'ifft':
+            real, imag = Function.idft(real_0, imag_0, Nrr)
+            S = (real + imag) * 2
+        else:
+            S = Function.idftReal(real_0, imag_0, Nrr)
+        S = S[:length]
 
-    rr_intervals = Utility.scaling(S, hmean, hstd)
-    singlePlot(rr_intervals, title='Generated RR Intervals', xlabel='Beat Index', ylabel='RR Interval (s)')
+    with stage('rr'):
+        rr_intervals = Utility.scaling(S, hmean, hstd)
 
-    metrics = {
-        'SDNN': Utility.SDNN(rr_intervals),
-        'RMSSD': Utility.RMSSD(rr_intervals), 
-        'pNN50': Utility.pNN50(rr_intervals)
+    with stage('metrics'):
+        metrics = {
+            'SDNN': Utility.SDNN(rr_intervals),
+            'RMSSD': Utility.RMSSD(rr_intervals), 
+            'pNN50': Utility.pNN50(rr_intervals)
+        }
+    return {
+        'Nrr': Nrr,
+        'spectrum': Sw_base,
+        'real_phase': real_0,
+        'imag_phase': imag_0,
+        'unit_series': S,
+        'rr_intervals': rr_intervals,
+        'metrics': metrics
     }
-    return rr_intervals, metrics
+
+
+def generate(f1, f2, c1, c2, duration, hmean, fs, hstd=None, domain='sample', seed=None, method='ifft', plot=False, profiler=None):
+    """Optimized generate function, see generateStages for the options
+
+    Returns the RR intervals and HRV metrics. plot=True renders the intermediate
+    stages with library.Plot, which is only imported in that case.
+    """
+    stages = generateStages(f1, f2, c1, c2, duration, hmean, fs, hstd, domain, seed, method, profiler)
+
+    if plot:
+        from library.Plot import generatePlots
+        generatePlots(stages)
+
+    return stages['rr_intervals'], stages['metrics']
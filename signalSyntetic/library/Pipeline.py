@@ -0,0 +1,290 @@
+import hashlib
+import numbers
+from collections import OrderedDict
+from contextlib import nullcontext
+import numpy as np
+
+from library.Function import Function, Utility, spectrumCache, waveTable
+from library.Variable import Morphology
+
+
+class Pipeline:
+    """Memoized RR and ECG generation pipeline
+
+    spectrum -> phase -> unit -> rr -> metrics
+                                   \\
+                     morphology -> ecg
+
+    Every stage result is cached under a hash of its own parameters and the keys
+    of the stages it reads, so after set() only the stages downstream of the
+    changed parameters run again. Changing hstd, for example, reruns rr, metrics
+    and ecg but reuses the spectrum, phases and unit series. Cached arrays are
+    shared with every caller and read-only, copy them before changing them.
+
+    phase_chunk=N draws the random phases of every N frequency bins from their own
+    stream of the seed, so one part of a long record's spectrum can be regenerated
+    or drawn in parallel without the rest. The default None uses one stream.
+
+    precision='float32' stores the unit series, RR intervals and ECG as float32,
+    half the memory of the default float64. The solvers still integrate in float64.
+    """
+    DEFAULTS = {
+        'f1': 0.1,
+        'f2': 0.25,
+        'c1': 0.01,
+        'c2': 0.01,
+        'duration': 10,
+        'hmean': 60,
+        'hstd': 1.0,
+        'fs': 256,
+        'seed': None,
+        'phase_chunk': None,
+        'method': 'ifft',
+        'domain': 'sample',
+        'engine': 'rk4',
+        'wave_tolerance': None,
+        'precision': 'float64'
+    }
+
+    PRECISIONS = {'float64': np.float64, 'float32': np.float32}
+
+    # (stage, parameters it reads, upstream stages it reads)
+    STAGES = (
+        ('spectrum', ('Nrr', 'f1', 'f2', 'c1', 'c2', 'method'), ()),
+        ('phase', ('seed', 'phase_chunk'), ('spectrum',)),
+        ('unit', ('Nrr', 'length', 'method', 'precision'), ('phase',)),
+        ('rr', ('hmean', 'hstd'), ('unit',)),
+        ('metrics', (), ('rr',)),
+        ('morphology', ('hmean',), ()),
+        ('ecg', ('fs', 'samples', 'domain', 'engine', 'wave_tolerance', 'precision'), ('rr', 'morphology')),
+    )
+
+    def __init__(self, cache_size=4, **params):
+        self.cache_size = cache_size
+        self.params = dict(self.DEFAULTS)
+        self.computed = []
+        self._stages = {name: (inputs, upstream) for name, inputs, upstream in self.STAGES}
+        self._cache = {name: OrderedDict() for name in self._stages}
+        self.set(**params)
+
+    def set(self, **params):
+        """Update parameters, stages are only recomputed by the next run() if affected"""
+        unknown = set(params) - set(self.DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown pipeline parameters: {', '.join(sorted(unknown))}")
+        if params.get('precision', 'float64') not in self.PRECISIONS:
+            raise ValueError(f"Unknown precision: {params['precision']}")
+
+        self.params.update(params)
+        if self.params['seed'] is None:
+            self.reseed()
+        return self
+
+    def reseed(self):
+        """Draw a new random phase realization"""
+        self.params['seed'] = np.random.SeedSequence().entropy
+        return self
+
+    def run(self, targets=None, callback=None, profiler=None):
+        """Compute the target stages (all by default) and return every stage result read
+
+        callback(stage) is called before each stage that actually has to be computed.
+        The names of those stages are kept in self.computed, and a StageProfiler
+        records the time and memory each of them takes.
+        """
+        values = self._values()
+
+        self.computed = []
+        keys = {}
+        results = {}
+        for name in targets or self._stages:
+            self._evaluate(name, values, keys, results, callback, profiler)
+
+        results['time'] = np.arange(values['samples']) / values['fs']
+        return results
+
+    def streamEcg(self, stages, chunk_size=4096):
+        """Yield the ECG for the stages of a run(['rr', 'morphology']) in chunks
+
+        The chunks join to the ecg stage of run() with the 'rk4' and 'vectorized'
+        engines, so a caller can show or store the record while it is solved and
+        stop between chunks. A stream read to the end is stored as the ecg stage,
+        and an ECG already in the cache is yielded from it without solving. Other
+        engines, such as 'adaptive', solve the ecg stage first and yield it in chunks.
+        """
+        fs, domain, engine = self.params['fs'], self.params['domain'], self.params['engine']
+        samples = len(stages['time'])
+        dtype = self.PRECISIONS[self.params['precision']]
+
+        key = self._key('ecg', self._values(), {})
+        cache = self._cache['ecg']
+        if key not in cache and engine not in ('rk4', 'vectorized'):
+            self.run(['ecg'])
+        if key in cache:
+            cache.move_to_end(key)
+            ecg = cache[key]
+            for start in range(0, len(ecg), chunk_size):
+                yield ecg[start:start + chunk_size]
+            return
+
+        dt, params = self._ecgInputs(fs, samples, domain, self.params['wave_tolerance'],
+                                     stages['rr'], stages['morphology'])
+        chunks = []
+        for chunk in Function.streamEcgModel(dt, iter(params['rr_series']), params, chunk_size, samples, engine):
+            chunks.append(chunk.astype(dtype, copy=False))
+            yield chunks[-1]
+
+        # Not reached when the caller stops early, partial ECGs are never cached
+        self._store('ecg', key, np.concatenate(chunks) if chunks else np.empty(0, dtype))
+
+    def clear(self):
+        for cache in self._cache.values():
+            cache.clear()
+
+    def _evaluate(self, name, values, keys, results, callback, profiler):
+        if name in results:
+            return
+
+        inputs, upstream = self._stages[name]
+        for dependency in upstream:
+            self._evaluate(dependency, values, keys, results, callback, profiler)
+
+        key = self._key(name, values, keys)
+        cache = self._cache[name]
+        if key in cache:
+            cache.move_to_end(key)
+        else:
+            if callback is not None:
+                callback(name)
+            kwargs = {parameter: values[parameter] for parameter in inputs}
+            kwargs.update((dependency, results[dependency]) for dependency in upstream)
+            with profiler.stage(name) if profiler is not None else nullcontext():
+                self._store(name, key, getattr(self, '_' + name)(**kwargs))
+            self.computed.append(name)
+
+        results[name] = cache[key]
+
+    def _values(self):
+        """Parameters with the derived sample and RR counts"""
+        values = dict(self.params)
+        values['samples'] = int(values['duration'] * values['fs'])
+        if values['domain'] == 'beat':
+            values['length'] = Utility.beatCount(values['duration'], values['hmean'])
+            values['Nrr'] = Utility.beatSynthesisLength(values['length'])
+        else:
+            values['length'] = values['Nrr'] = values['samples']
+        return values
+
+    def _key(self, name, values, keys):
+        """Cache key of a stage, from its parameters and the keys of its upstream stages"""
+        if name not in keys:
+            inputs, upstream = self._stages[name]
+            for dependency in upstream:
+                self._key(dependency, values, keys)
+            own = tuple((key, self._keyValue(values[key])) for key in inputs)
+            keys[name] = hashlib.sha1(repr((name, own, [keys[d] for d in upstream])).encode()).hexdigest()
+        return keys[name]
+
+    def _store(self, name, key, value):
+        cache = self._cache[name]
+        cache[key] = self._freeze(value)
+        while len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+    @classmethod
+    def _freeze(cls, value):
+        """Mark the arrays of a stage result read-only, every cache hit returns the same objects"""
+        if isinstance(value, np.ndarray):
+            value.setflags(write=False)
+        elif isinstance(value, (tuple, list)):
+            for item in value:
+                cls._freeze(item)
+        elif isinstance(value, dict):
+            for item in value.values():
+                cls._freeze(item)
+        elif isinstance(value, Morphology):
+            for key in value.KEYS:
+                cls._freeze(value[key])
+        return value
+
+    @staticmethod
+    def _keyValue(value):
+        """Same key for equal numbers of any type, e.g. 1, 1.0 and np.float64(1.0)
+
+        Integral values become exact ints so that large seeds keep every digit.
+        """
+        if isinstance(value, bool) or not isinstance(value, numbers.Real):
+            return value
+        if isinstance(value, numbers.Integral):
+            return int(value)
+        value = float(value)
+        return int(value) if value.is_integer() else value
+
+    @staticmethod
+    def _spectrum(Nrr, f1, f2, c1, c2, method):
+        if method == 'irfft':
+            Sw = spectrumCache.gaussianOneSided(Nrr, f1, f2, c1, c2)
+            return {'Sw': Sw, 'total': Sw[1:Nrr//2]}
+        if method == 'ifft':
+            Sw, total = spectrumCache.gaussianLoop(Nrr, f1, f2, c1, c2)
+            return {'Sw': Sw, 'total': total}
+        raise ValueError(f"Unknown RR synthesis method: {method}")
+
+    @staticmethod
+    def _phase(seed, phase_chunk, spectrum):
+        Sw = spectrum['Sw']
+        return Function.randomPhase(Sw, len(Sw), seed, chunk_size=phase_chunk)
+
+    @classmethod
+    def _unit(cls, Nrr, length, method, precision, phase):
+        # Beat-domain series are synthesized longer than the beats used, see generateStages
+        real_0, imag_0 = phase
+        if method == 'irfft':
+            unit = Function.idftReal(real_0, imag_0, Nrr)
+        else:
+            real, imag = Function.idft(real_0, imag_0, Nrr)
+            unit = (real + imag) * 2
+        return unit[:length].astype(cls.PRECISIONS[precision], copy=False)
+
+    @staticmethod
+    def _rr(hmean, hstd, unit):
+        # Keeps the dtype of the unit series
+        return Utility.scaling(unit, hmean, hstd)
+
+    @staticmethod
+    def _metrics(rr):
+        return {
+            'SDNN': Utility.SDNN(rr),
+            'RMSSD': Utility.RMSSD(rr),
+            'pNN50': Utility.pNN50(rr),
+            'BPM': 60 / np.mean(rr)
+        }
+
+    @staticmethod
+    def _morphology(hmean):
+        return Morphology.default().scaled(hmean)
+
+    @staticmethod
+    def _ecgInputs(fs, samples, domain, wave_tolerance, rr, morphology):
+        """Time step and solver params of the ecg stage"""
+        dt = 1 / fs
+        if domain == 'beat':
+            rr = Utility.sampleRR(rr, fs, samples)
+
+        params = dict(morphology, dt=dt, rr_series=rr)
+        if wave_tolerance is not None:
+            params['wave_table'] = waveTable(morphology['ai'], morphology['bi'], morphology['ti'], wave_tolerance)
+        return dt, params
+
+    @classmethod
+    def _ecg(cls, fs, samples, domain, engine, wave_tolerance, precision, rr, morphology):
+        dt, params = cls._ecgInputs(fs, samples, domain, wave_tolerance, rr, morphology)
+        if engine == 'vectorized':
+            ecg = Function.solveEcgVectorized(dt, samples, params)
+        elif engine == 'adaptive':
+            ecg = Function.solveEcgAdaptive(dt, samples, params)
+        elif engine == 'rk4':
+            ecg = Function.solveEcgModel(dt, samples, params)
+        else:
+            raise ValueError(f"Unknown ECG engine: {engine}")
+        return ecg.astype(cls.PRECISIONS[precision], copy=False)
@@ -1,6 +1,54 @@
 import matplotlib.pyplot as plt
 import numpy as np
 
+from library.Decimate import decimate, plotDetail
+
+
+def plotlyTrace(x, y, **kwargs):
+    """WebGL plotly line trace of a min/max decimated signal, x may be None for the sample index
+
+    The trace keeps the NumPy arrays, which plotly 6 sends to the browser as base64
+    typed arrays instead of JSON number lists, and y is sent as float32.
+    """
+    import plotly.graph_objects as go
+    x, y = decimate(x, y)
+    if np.issubdtype(x.dtype, np.integer):
+        x = x.astype(np.int32)  # typed arrays in the browser have no int64
+    return go.Scattergl(x=x, y=np.asarray(y, dtype=np.float32), **kwargs)
+
+
+def streamlitPlotly(build):
+    """st.plotly_chart of the figure build() returns, False if Streamlit or Plotly is missing
+
+    Only the plotly figure is built, the caller draws with matplotlib when this fails.
+    """
+    try:
+        import streamlit as st
+        fig = build()
+    except ImportError as e:
+        print(f"Streamlit or Plotly not available: {e}, falling back to matplotlib")
+        return False
+    st.plotly_chart(fig, use_container_width=True)
+    return True
+
+
+def showFigure(fig, mode=None, interactive=True):
+    """st.pyplot for a static streamlit plot, otherwise plt.show, then close the figure
+
+    An interactive streamlit plot only gets here when streamlitPlotly failed.
+    """
+    if mode == 'streamlit' and not interactive:
+        try:
+            import streamlit as st
+            st.pyplot(fig)
+            plt.close(fig)
+            return
+        except ImportError:
+            print("Streamlit not available, falling back to matplotlib")
+    plt.show()
+    plt.close(fig)  # Clean up memory
+
+
 def singlePlot(time_or_data, data=None, title="", xlabel="", ylabel="", mode=None, interactive=True):
     """
     Flexible plot function that works with both Streamlit and regular matplotlib
@@ -16,59 +64,71 @@ def singlePlot(time_or_data, data=None, title="", xlabel="", ylabel="", mode=Non
     """
     if data is None:
         plot_data = time_or_data
-        x_axis = range(len(plot_data))
+        x_axis = None
     else:
         x_axis = time_or_data
         plot_data = data
-    
+
+    # Streamlit has built-in zoom with plotly
+    if mode == 'streamlit' and interactive:
+        def build():
+            import plotly.graph_objects as go
+            fig_plotly = go.Figure()
+            fig_plotly.add_trace(plotlyTrace(x_axis, plot_data,
+                                             mode='lines', name='Signal',
+                                             line=dict(color='blue', width=1)))
+            fig_plotly.update_layout(
+                title=title,
+                xaxis_title=xlabel,
+                yaxis_title=ylabel,
+                showlegend=False,
+                width=800,
+                height=400
+            )
+            return fig_plotly
+
+        if streamlitPlotly(build):
+            return
+
     fig, ax = plt.subplots(figsize=(10, 6))
-    ax.plot(x_axis, plot_data, 'b-', linewidth=1)
+    plotDetail(ax, x_axis, plot_data, 'b-', linewidth=1)
     ax.set_title(title)
     ax.set_xlabel(xlabel)
     ax.set_ylabel(ylabel)
     ax.grid(True, alpha=0.3)
-    
-    if mode == 'streamlit':
-        try:
-            import streamlit as st
-            # Streamlit has built-in zoom with plotly
-            if interactive:
-                import plotly.graph_objects as go
-                fig_plotly = go.Figure()
-                fig_plotly.add_trace(go.Scatter(x=list(x_axis), y=list(plot_data), 
-                                              mode='lines', name='Signal',
-                                              line=dict(color='blue', width=1)))
-                fig_plotly.update_layout(
-                    title=title,
-                    xaxis_title=xlabel,
-                    yaxis_title=ylabel,
-                    showlegend=False,
-                    width=800,
-                    height=400
-                )
-                st.plotly_chart(fig_plotly, use_container_width=True)
-                plt.close(fig)  # Close matplotlib figure
-                return
-            else:
-                st.pyplot(fig)
-        except ImportError as e:
-            print(f"Streamlit or Plotly not available: {e}, falling back to matplotlib")
-            if interactive:
-                # Enable matplotlib zoom/pan toolbar
-                plt.subplots_adjust(bottom=0.15)  # Make room for toolbar
-            plt.show()
-    else:
-        if interactive:
-            # Enable matplotlib zoom/pan toolbar
-            plt.subplots_adjust(bottom=0.15)  # Make room for toolbar
-        plt.show()
-    
-    plt.close(fig)  # Clean up memory
+
+    if interactive:
+        # Enable matplotlib zoom/pan toolbar
+        plt.subplots_adjust(bottom=0.15)  # Make room for toolbar
+    showFigure(fig, mode, interactive)
 
 def singlePlotWithTime(time_axis, data, title='Plot', xlabel='Time (s)', ylabel='Amplitude', mode=None, interactive=True):
     """Plot data with proper time axis and enhanced formatting"""
+    # Use plotly for interactive zoom in streamlit
+    if mode == 'streamlit' and interactive:
+        def build():
+            import plotly.graph_objects as go
+            fig_plotly = go.Figure()
+            fig_plotly.add_trace(plotlyTrace(time_axis, data,
+                                             mode='lines', name='Signal',
+                                             line=dict(color='blue', width=1)))
+            fig_plotly.update_layout(
+                title=title,
+                xaxis_title=xlabel,
+                yaxis_title=ylabel,
+                showlegend=False,
+                width=1000,
+                height=500,
+                xaxis=dict(showgrid=True, gridwidth=1, gridcolor='lightgray'),
+                yaxis=dict(showgrid=True, gridwidth=1, gridcolor='lightgray')
+            )
+            return fig_plotly
+
+        if streamlitPlotly(build):
+            return
+
     fig, ax = plt.subplots(figsize=(12, 6))
-    ax.plot(time_axis, data, 'b-', linewidth=1)
+    plotDetail(ax, time_axis, data, 'b-', linewidth=1)
     ax.set_title(title)
     ax.set_xlabel(xlabel)
     ax.set_ylabel(ylabel)
@@ -85,138 +145,103 @@ def singlePlotWithTime(time_axis, data, title='Plot', xlabel='Time (s)', ylabel=
     ax.grid(which='major', alpha=0.5)
     
     plt.tight_layout()
-    
-    if mode == 'streamlit':
-        try:
-            import streamlit as st
-            # Use plotly for interactive zoom in streamlit
-            if interactive:
-                import plotly.graph_objects as go
-                fig_plotly = go.Figure()
-                fig_plotly.add_trace(go.Scatter(x=list(time_axis), y=list(data), 
-                                              mode='lines', name='Signal',
-                                              line=dict(color='blue', width=1)))
-                fig_plotly.update_layout(
-                    title=title,
-                    xaxis_title=xlabel,
-                    yaxis_title=ylabel,
-                    showlegend=False,
-                    width=1000,
-                    height=500,
-                    xaxis=dict(showgrid=True, gridwidth=1, gridcolor='lightgray'),
-                    yaxis=dict(showgrid=True, gridwidth=1, gridcolor='lightgray')
-                )
-                st.plotly_chart(fig_plotly, use_container_width=True)
-                plt.close(fig)  # Close matplotlib figure
-                return
-            else:
-                st.pyplot(fig)
-        except ImportError as e:
-            print(f"Streamlit or Plotly not available: {e}, falling back to matplotlib")
-            if interactive:
-                plt.subplots_adjust(bottom=0.15)  # Make room for toolbar
-            plt.show()
-    else:
-        if interactive:
-            plt.subplots_adjust(bottom=0.15)  # Make room for toolbar
-        plt.show()
-    
-    plt.close(fig)  # Clean up memory
+
+    if interactive:
+        plt.subplots_adjust(bottom=0.15)  # Make room for toolbar
+    showFigure(fig, mode, interactive)
 
 def sideBySide(one, two, mode=None, interactive=True):
+    if mode == 'streamlit' and interactive:
+        def build():
+            from plotly.subplots import make_subplots
+
+            fig_plotly = make_subplots(rows=1, cols=2, subplot_titles=('S_f', 'S'))
+            fig_plotly.add_trace(plotlyTrace(None, one, mode='lines', name='S_f'), row=1, col=1)
+            fig_plotly.add_trace(plotlyTrace(None, two, mode='lines', name='S'), row=1, col=2)
+            fig_plotly.update_layout(showlegend=False, width=1000, height=400)
+            return fig_plotly
+
+        if streamlitPlotly(build):
+            return
+
     fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(12, 5))
 
-    ax1.plot(one)
+    plotDetail(ax1, None, one)
     ax1.set_title('S_f')
     ax1.grid(True)
 
-    ax2.plot(two)
+    plotDetail(ax2, None, two)
     ax2.set_title('S')
     ax2.grid(True)
 
     if interactive:
         plt.subplots_adjust(bottom=0.15)  # Make room for toolbar
     plt.tight_layout()
-    
-    if mode == 'streamlit':
-        try:
-            import streamlit as st
-            if interactive:
-                import plotly.graph_objects as go
-                from plotly.subplots import make_subplots
-                
-                fig_plotly = make_subplots(rows=1, cols=2, subplot_titles=('S_f', 'S'))
-                fig_plotly.add_trace(go.Scatter(y=list(one), mode='lines', name='S_f'), row=1, col=1)
-                fig_plotly.add_trace(go.Scatter(y=list(two), mode='lines', name='S'), row=1, col=2)
-                fig_plotly.update_layout(showlegend=False, width=1000, height=400)
-                st.plotly_chart(fig_plotly, use_container_width=True)
-                plt.close(fig)
-                return
-            else:
-                st.pyplot(fig)
-        except ImportError:
-            print("Streamlit or Plotly not available, falling back to matplotlib")
-            plt.show()
-    else:
-        plt.show()
-    
-    plt.close(fig)
+    showFigure(fig, mode, interactive)
 
 def plot4Row(one, two, three, four, mode=None, interactive=True):
+    if mode == 'streamlit' and interactive:
+        def build():
+            from plotly.subplots import make_subplots
+
+            fig_plotly = make_subplots(rows=2, cols=2, 
+                                     subplot_titles=('Plot 1', 'Plot 2', 'Plot 3', 'Plot 4'))
+            fig_plotly.add_trace(plotlyTrace(None, one, mode='lines', name='Plot 1'), row=1, col=1)
+            fig_plotly.add_trace(plotlyTrace(None, two, mode='lines', name='Plot 2'), row=1, col=2)
+            fig_plotly.add_trace(plotlyTrace(None, three, mode='lines', name='Plot 3'), row=2, col=1)
+            fig_plotly.add_trace(plotlyTrace(None, four, mode='lines', name='Plot 4'), row=2, col=2)
+            fig_plotly.update_layout(showlegend=False, width=1000, height=600)
+            return fig_plotly
+
+        if streamlitPlotly(build):
+            return
+
     fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(12, 10))
 
-    ax1.plot(one)
+    plotDetail(ax1, None, one)
     ax1.set_title('Plot 1')
     ax1.grid(True)
 
-    ax2.plot(two)
+    plotDetail(ax2, None, two)
     ax2.set_title('Plot 2')
     ax2.grid(True)
 
-    ax3.plot(three)
+    plotDetail(ax3, None, three)
     ax3.set_title('Plot 3')
     ax3.grid(True)
 
-    ax4.plot(four)
+    plotDetail(ax4, None, four)
     ax4.set_title('Plot 4')
     ax4.grid(True)
 
     if interactive:
         plt.subplots_adjust(bottom=0.1)
     plt.tight_layout()
-    
-    if mode == 'streamlit':
-        try:
-            import streamlit as st
-            if interactive:
-                import plotly.graph_objects as go
-                from plotly.subplots import make_subplots
-                
-                fig_plotly = make_subplots(rows=2, cols=2, 
-                                         subplot_titles=('Plot 1', 'Plot 2', 'Plot 3', 'Plot 4'))
-                fig_plotly.add_trace(go.Scatter(y=list(one), mode='lines', name='Plot 1'), row=1, col=1)
-                fig_plotly.add_trace(go.Scatter(y=list(two), mode='lines', name='Plot 2'), row=1, col=2)
-                fig_plotly.add_trace(go.Scatter(y=list(three), mode='lines', name='Plot 3'), row=2, col=1)
-                fig_plotly.add_trace(go.Scatter(y=list(four), mode='lines', name='Plot 4'), row=2, col=2)
-                fig_plotly.update_layout(showlegend=False, width=1000, height=600)
-                st.plotly_chart(fig_plotly, use_container_width=True)
-                plt.close(fig)
-                return
-            else:
-                st.pyplot(fig)
-        except ImportError:
-            print("Streamlit or Plotly not available, falling back to matplotlib")
-            plt.show()
-    else:
-        plt.show()
-    
-    plt.close(fig)
+    showFigure(fig, mode, interactive)
 
 def combine2Plot(one, two, label='Plot 1', label2='Plot 2', mode=None, interactive=True):
+    if mode == 'streamlit' and interactive:
+        def build():
+            import plotly.graph_objects as go
+
+            fig_plotly = go.Figure()
+            fig_plotly.add_trace(plotlyTrace(None, one, mode='lines', name=label))
+            fig_plotly.add_trace(plotlyTrace(None, two, mode='lines', name=label2))
+            fig_plotly.update_layout(
+                title='Combined Plot',
+                width=1000,
+                height=500,
+                showlegend=True
+            )
+            return fig_plotly
+
+        if streamlitPlotly(build):
+            return
+
     fig, ax = plt.subplots(figsize=(12, 8))
 
-    ax.plot(one, label=label)
-    ax.plot(two, label=label2)
+    plotDetail(ax, None, one, label=label)
+    plotDetail(ax, None, two, label=label2)
 
     ax.set_title('Combined Plot')
     ax.legend()
@@ -225,32 +250,11 @@ def combine2Plot(one, two, label='Plot 1', label2='Plot 2', mode=None, interacti
     if interactive:
         plt.subplots_adjust(bottom=0.15)
     plt.tight_layout()
-    
-    if mode == 'streamlit':
-        try:
-            import streamlit as st
-            if interactive:
-                import plotly.graph_objects as go
-                
-                fig_plotly = go.Figure()
-                fig_plotly.add_trace(go.Scatter(y=list(one), mode='lines', name=label))
-                fig_plotly.add_trace(go.Scatter(y=list(two), mode='lines', name=label2))
-                fig_plotly.update_layout(
-                    title='Combined Plot',
-                    width=1000,
-                    height=500,
-                    showlegend=True
-                )
-                st.plotly_chart(fig_plotly, use_container_width=True)
-                plt.close(fig)
-                return
-            else:
-                st.pyplot(fig)
-        except ImportError:
-            print("Streamlit or Plotly not available, falling back to matplotlib")
-            plt.show()
-    else:
-        plt.show()
-    
-    plt.close(fig)
-    return ax
\ No newline at end of file
+    showFigure(fig, mode, interactive)
+    return ax
+
+def generatePlots(stages, mode=None):
+    """Visualize the intermediate stages returned by library.Function.generateStages"""
+    singlePlot(stages['spectrum'], title='Base Power Spectrum', xlabel='Frequency Bin', ylabel='Magnitude', mode=mode)
+    combine2Plot(stages['real_phase'], stages['imag_phase'], label='Real Part', label2='Imaginary Part', mode=mode)
+    singlePlot(stages['rr_intervals'], title='Generated RR Intervals', xlabel='Beat Index', ylabel='RR Interval (s)', mode=mode)
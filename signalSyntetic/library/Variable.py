@@ -1,6 +1,8 @@
 from dataclasses import dataclass, fields
 import math
 
+import numpy as np
+
 @dataclass
 class Angle:
     p: float = 0
@@ -32,4 +34,72 @@ class Amplitude:
             # Check if it's a number before multiplying
             if isinstance(current_value, (int, float)):
                 # Update the value
-                setattr(self, field.name, current_value * factor)
\ No newline at end of file
+                setattr(self, field.name, current_value * factor)
+
+
+@dataclass(eq=False)
+class Morphology:
+    """P, Q, R, S, T wave parameters as arrays of shape (5,), or (batch, 5) for many records
+
+    ai are the amplitudes, bi the widths and ti the angles in radians of the
+    Gaussian events. It reads like a dict of 'ai', 'bi' and 'ti', so it goes
+    straight into the solvers with dict(morphology, dt=dt, rr_series=rr).
+    """
+    ai: np.ndarray
+    bi: np.ndarray
+    ti: np.ndarray
+
+    KEYS = ('ai', 'bi', 'ti')
+
+    def __post_init__(self):
+        self.ai = np.asarray(self.ai, dtype=float)
+        self.bi = np.asarray(self.bi, dtype=float)
+        self.ti = np.asarray(self.ti, dtype=float)
+
+    @classmethod
+    def default(cls):
+        """Resting morphology of the model, angles given in degrees"""
+        return cls(
+            ai=[1.2, -5.0, 30.0, -7.5, 0.75],
+            bi=[0.25, 0.1, 0.1, 0.1, 0.4],
+            ti=np.radians([-60, -15, 0, 15, 90])
+        )
+
+    @classmethod
+    def stack(cls, morphologies):
+        """Struct-of-arrays batch of single record morphologies"""
+        return cls(*(np.stack([getattr(m, key) for m in morphologies]) for key in cls.KEYS))
+
+    @property
+    def batch(self):
+        """Number of records, None for a single morphology"""
+        return self.ai.shape[0] if self.ai.ndim == 2 else None
+
+    def scaled(self, hmean):
+        """Heart rate dependent morphology, same scaling as Utility.doubleFactorial
+
+        Widths and the P and T angles scale with hmean / 60, the Q and S angles with
+        its square root. An array of heart rates gives a batch, one record per rate.
+        """
+        hmean = np.asarray(hmean, dtype=float)[..., None]
+        hfactor1 = np.where(hmean > 0, np.sqrt(np.abs(hmean) / 60.0), 1.0)
+        hfactor2 = hfactor1**2
+        angle_factor = np.concatenate([hfactor2, hfactor1, np.ones_like(hfactor1), hfactor1, hfactor2], axis=-1)
+
+        return Morphology(
+            ai=np.broadcast_to(self.ai, np.broadcast(self.ai, angle_factor).shape).copy(),
+            bi=self.bi * hfactor2,
+            ti=self.ti * angle_factor
+        )
+
+    def record(self, index):
+        """Morphology of one record of a batch"""
+        return Morphology(self.ai[index], self.bi[index], self.ti[index])
+
+    def keys(self):
+        return self.KEYS
+
+    def __getitem__(self, key):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
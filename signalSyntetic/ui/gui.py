@@ -4,16 +4,25 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from PyQt5 import uic
 from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout
-from PyQt5.QtCore import QThread, pyqtSignal
+from PyQt5.QtCore import QThread, QTimer, pyqtSignal
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
 import numpy as np
 
-from library.Function import Function, Utility
-from library.Variable import Angle, Amplitude
+from library.Decimate import DetailLine
+from library.Pipeline import Pipeline
+from library.Profile import StageProfiler
 
 class ZoomOnlyPlotCanvas(FigureCanvas):
+    """Plot canvas with one persistent axes whose lines are reused between plots
+
+    New data only replaces the line data. The lines are animated artists drawn
+    over a cached background, so a wheel zoom repaints by blitting just the lines.
+    The full redraw that refreshes ticks and grid runs once the wheel settles.
+    """
+    SETTLE_MS = 150
+
     def __init__(self, parent=None, width=5, height=4, dpi=100):
         self.fig = Figure(figsize=(width, height), dpi=dpi)
         super().__init__(self.fig)
@@ -27,9 +36,35 @@ class ZoomOnlyPlotCanvas(FigureCanvas):
         self.original_xlim = None
         self.original_ylim = None
         
+        # Persistent axes, lines and their decimation state
+        self.ax = None
+        self.lines = []
+        self.details = []
+        self.message = None
+        self.background = None
+        
+        # Full redraw once the wheel stops, blits in between
+        self.settle_timer = QTimer(self)
+        self.settle_timer.setSingleShot(True)
+        self.settle_timer.setInterval(self.SETTLE_MS)
+        self.settle_timer.timeout.connect(self.draw_idle)
+        
         # Connect scroll event for zoom
         self.mpl_connect('scroll_event', self.on_scroll)
         self.mpl_connect('button_press_event', self.on_double_click)
+        self.mpl_connect('draw_event', self.on_draw)
+        
+    def on_draw(self, event):
+        """Cache everything but the lines, then draw the lines on top"""
+        if self.ax is None:
+            return
+        self.background = self.copy_from_bbox(self.fig.bbox)
+        self.draw_lines()
+        
+    def draw_lines(self):
+        for line in self.lines:
+            if line.get_visible():
+                self.ax.draw_artist(line)
         
     def on_scroll(self, event):
         """Handle mouse wheel zoom"""
@@ -70,9 +105,18 @@ class ZoomOnlyPlotCanvas(FigureCanvas):
         new_ylim = [y_mouse - new_y_range * (y_mouse - ylim[0]) / y_range,
                    y_mouse + new_y_range * (ylim[1] - y_mouse) / y_range]
         
+        # The new xlim re-decimates every line to the samples of the visible window
         ax.set_xlim(new_xlim)
         ax.set_ylim(new_ylim)
-        self.draw()
+        
+        # Repaint only the lines now, ticks and grid once scrolling stops
+        if self.background is None:
+            self.draw_idle()
+        else:
+            self.restore_region(self.background)
+            self.draw_lines()
+            self.blit(self.fig.bbox)
+        self.settle_timer.start()
         
     def on_double_click(self, event):
         """Reset zoom on double click"""
@@ -80,100 +124,116 @@ class ZoomOnlyPlotCanvas(FigureCanvas):
             ax = event.inaxes
             ax.set_xlim(self.original_xlim)
             ax.set_ylim(self.original_ylim)
-            self.draw()
-        
-    def plot_data(self, data, title="Plot", color='blue', xlabel="Sample Index", ylabel="Amplitude"):
-        self.fig.clear()
+            self.draw_idle()
+        
+    def prepare_axes(self, count, xlabel, ylabel):
+        """Persistent axes with `count` visible lines, creating lines only when missing"""
+        if self.ax is None:
+            # Create subplot with margins for axis labels
+            self.ax = self.fig.add_subplot(111)
+            self.ax.grid(True, alpha=0.3)
+            self.ax.tick_params(labelsize=8)
+            
+            # Adjust margins to show axis labels properly - MORE SPACE FOR LABELS
+            self.fig.subplots_adjust(left=0.18, bottom=0.22, right=0.95, top=0.95, wspace=0, hspace=0)
         
-        # Create subplot with margins for axis labels
-        ax = self.fig.add_subplot(111)
+        while len(self.lines) < count:
+            line, = self.ax.plot([], [], linewidth=1, animated=True)
+            self.lines.append(line)
+        for i, line in enumerate(self.lines):
+            line.set_visible(i < count)
         
-        line, = ax.plot(data, color=color, linewidth=1)
         # Remove title
-        ax.set_xlabel(xlabel, fontsize=10, fontweight='bold')
-        ax.set_ylabel(ylabel, fontsize=10, fontweight='bold')
-        ax.grid(True, alpha=0.3)
-        ax.tick_params(labelsize=8)
+        self.ax.set_xlabel(xlabel, fontsize=10, fontweight='bold')
+        self.ax.set_ylabel(ylabel, fontsize=10, fontweight='bold')
         
-        # Store original limits for reset
-        self.original_xlim = ax.get_xlim()
-        self.original_ylim = ax.get_ylim()
+        legend = self.ax.get_legend()
+        if legend is not None:
+            legend.remove()
+        if self.message is not None:
+            self.message.set_visible(False)
         
-        # Adjust margins to show axis labels properly - MORE SPACE FOR LABELS
-        self.fig.subplots_adjust(left=0.18, bottom=0.22, right=0.95, top=0.95, wspace=0, hspace=0)
-        self.draw()
+        return self.lines[:count]
         
-    def plot_xy(self, x_data, y_data, title="Plot", xlabel="X", ylabel="Y", color='blue'):
-        self.fig.clear()
+    def set_series(self, series):
+        """Give the visible lines new (x, y, color, label) data and rescale to it"""
+        for detail in self.details:
+            detail.remove()
         
-        # Create subplot with margins for axis labels
-        ax = self.fig.add_subplot(111)
+        self.ax.set_autoscale_on(True)
+        self.details = []
+        for line, (x, y, color, label) in zip(self.lines, series):
+            line.set_color(color)
+            line.set_label(label)
+            self.details.append(DetailLine(line, x, y))
         
-        line, = ax.plot(x_data, y_data, color=color, linewidth=1)
-        # Remove title
-        ax.set_xlabel(xlabel, fontsize=10, fontweight='bold')
-        ax.set_ylabel(ylabel, fontsize=10, fontweight='bold')
-        ax.grid(True, alpha=0.3)
-        ax.tick_params(labelsize=8)
+        self.ax.relim(visible_only=True)
+        self.ax.autoscale_view()
         
         # Store original limits for reset
-        self.original_xlim = ax.get_xlim()
-        self.original_ylim = ax.get_ylim()
-        
-        # Adjust margins to show axis labels properly - MORE SPACE FOR LABELS
-        self.fig.subplots_adjust(left=0.18, bottom=0.22, right=0.95, top=0.95, wspace=0, hspace=0)
-        self.draw()
-        
-    def plot_combined(self, data1, data2, title="Combined Plot", label1="Real", label2="Imag"):
-        self.fig.clear()
+        self.original_xlim = self.ax.get_xlim()
+        self.original_ylim = self.ax.get_ylim()
+        self.draw_idle()
         
-        # Create subplot with margins for axis labels
-        ax = self.fig.add_subplot(111)
-        
-        line1, = ax.plot(data1, label=label1, linewidth=1, color='blue')
-        line2, = ax.plot(data2, label=label2, linewidth=1, color='red')
+    def plot_data(self, data, title="Plot", color='blue', xlabel="Sample Index", ylabel="Amplitude"):
+        self.prepare_axes(1, xlabel, ylabel)
+        self.set_series([(None, data, color, '_data')])
         
-        # Remove title
-        ax.set_xlabel("Sample Index", fontsize=10, fontweight='bold')
-        ax.set_ylabel("Amplitude", fontsize=10, fontweight='bold')
-        ax.legend(fontsize=8, loc='upper right')
-        ax.grid(True, alpha=0.3)
-        ax.tick_params(labelsize=8)
+    def plot_xy(self, x_data, y_data, title="Plot", xlabel="X", ylabel="Y", color='blue'):
+        self.prepare_axes(1, xlabel, ylabel)
+        self.set_series([(x_data, y_data, color, '_data')])
         
-        # Store original limits for reset
-        self.original_xlim = ax.get_xlim()
-        self.original_ylim = ax.get_ylim()
-          
-        # Adjust margins to show axis labels properly - MORE SPACE FOR LABELS
-        self.fig.subplots_adjust(left=0.18, bottom=0.22, right=0.95, top=0.95, wspace=0, hspace=0)
-        self.draw()
+    def plot_combined(self, data1, data2, title="Combined Plot", label1="Real", label2="Imag"):
+        self.prepare_axes(2, "Sample Index", "Amplitude")
+        self.set_series([(None, data1, 'blue', label1), (None, data2, 'red', label2)])
+        self.ax.legend(handles=self.lines[:2], fontsize=8, loc='upper right')
+        
+    def begin_stream(self, x_data, xlabel="X", ylabel="Y", color='blue'):
+        """Empty line over the full x range of a signal that arrives with append_stream"""
+        line, = self.prepare_axes(1, xlabel, ylabel)
+        for detail in self.details:
+            detail.remove()
+        
+        self.stream_x = np.asarray(x_data)
+        self.stream_y = np.empty(len(self.stream_x))
+        self.stream_count = 0
+        self.stream_ylim = None
+        
+        line.set_color(color)
+        line.set_label('_data')
+        self.details = [DetailLine(line, self.stream_x[:0], self.stream_y[:0])]
+        self.ax.set_xlim(self.stream_x[0], self.stream_x[-1])
+        self.draw_idle()
+        
+    def append_stream(self, chunk):
+        """Add the next samples, only the new chunk is copied and scanned for the y range"""
+        start = self.stream_count
+        self.stream_count = start + len(chunk)
+        self.stream_y[start:self.stream_count] = chunk
+        
+        low, high = float(np.min(chunk)), float(np.max(chunk))
+        if self.stream_ylim is not None:
+            low, high = min(low, self.stream_ylim[0]), max(high, self.stream_ylim[1])
+        self.stream_ylim = (low, high)
+        margin = 0.05 * (high - low) or 0.05
+        self.ax.set_ylim(low - margin, high + margin)
+        
+        self.details[0].setData(self.stream_x[:self.stream_count], self.stream_y[:self.stream_count])
+        self.draw_idle()
         
     def plot_empty(self, title="Plot"):
         """Display an empty plot"""
-        self.fig.clear()
-        
-        # Create subplot with margins for axis labels
-        ax = self.fig.add_subplot(111)
-        
-        ax.plot([0, 1], [0, 0], color='lightgray', linewidth=1)
-        # Remove title
-        ax.set_xlabel("Index", fontsize=10, fontweight='bold')
-        ax.set_ylabel("Value", fontsize=10, fontweight='bold')
-        ax.grid(True, alpha=0.3)
-        ax.tick_params(labelsize=8)
+        self.prepare_axes(1, "Index", "Value")
         
-        ax.text(0.5, 0.5, 'No data\nScroll to zoom, double-click to reset\nClick Generate to create signal', 
-               transform=ax.transAxes, ha='center', va='center',
-               fontsize=8, color='gray',
-               bbox=dict(boxstyle='round', facecolor='lightgray', alpha=0.5))
+        if self.message is None:
+            self.message = self.ax.text(
+                0.5, 0.5, 'No data\nScroll to zoom, double-click to reset\nClick Generate to create signal',
+                transform=self.ax.transAxes, ha='center', va='center',
+                fontsize=8, color='gray',
+                bbox=dict(boxstyle='round', facecolor='lightgray', alpha=0.5))
+        self.message.set_visible(True)
         
-        # Store original limits for reset
-        self.original_xlim = ax.get_xlim()
-        self.original_ylim = ax.get_ylim()
-        
-        # Adjust margins to show axis labels properly - MORE SPACE FOR LABELS
-        self.fig.subplots_adjust(left=0.18, bottom=0.22, right=0.95, top=0.95, wspace=0, hspace=0)
-        self.draw()
+        self.set_series([([0, 1], [0, 0], 'lightgray', '_empty')])
 
 class ZoomOnlyPlotWidget(QWidget):
     def __init__(self, parent=None, width=5, height=4):
@@ -199,95 +259,95 @@ class ZoomOnlyPlotWidget(QWidget):
         
     def plot_empty(self, *args, **kwargs):
         return self.canvas.plot_empty(*args, **kwargs)
+        
+    def begin_stream(self, *args, **kwargs):
+        return self.canvas.begin_stream(*args, **kwargs)
+        
+    def append_stream(self, *args, **kwargs):
+        return self.canvas.append_stream(*args, **kwargs)
 
 class ECGGenerationThread(QThread):
+    """Runs the pipeline, then solves the ECG chunk by chunk
+
+    rr_ready carries the spectra, phases and RR intervals as soon as they exist,
+    ecg_chunk every solved piece of the ECG. requestInterruption() stops the
+    solve after the chunk in progress and emits cancelled instead of finished.
+    """
     finished = pyqtSignal(dict)
+    rr_ready = pyqtSignal(dict)
+    ecg_chunk = pyqtSignal(object)
+    cancelled = pyqtSignal()
     progress = pyqtSignal(str)
     error = pyqtSignal(str)
     
-    def __init__(self, params):
+    # About a quarter of a second of RK4 work per chunk
+    CHUNK_SIZE = 4096
+    
+    STAGE_MESSAGES = {
+        'spectrum': "Generating Gaussian spectrum...",
+        'phase': "Generating random phase...",
+        'unit': "Computing IDFT...",
+        'rr': "Scaling RR intervals...",
+        'metrics': "Calculating HRV metrics...",
+        'morphology': "Setting up ECG morphology...",
+        'ecg': "Generating ECG signal..."
+    }
+    
+    def __init__(self, params, pipeline, profiler):
         super().__init__()
         self.params = params
+        self.pipeline = pipeline
+        self.profiler = profiler
     
     def run(self):
         try:
             self.progress.emit("Starting generation...")
             
-            # Parameters
-            duration = self.params['duration']
-            hmean = self.params['hmean']
-            hstd = self.params['hstd']
-            fs = self.params['fs']
-            f1 = 0.1
-            f2 = 0.25
-            c1 = 0.01
-            c2 = 0.01
-            
-            Nrr = int(duration * fs)
-            
-            self.progress.emit("Generating Gaussian spectrum...")
-            # Generate Gaussian spectrum
-            Sw, total = Function.gaussianLoop(Nrr, f1, f2, c1, c2)
-            
-            self.progress.emit("Generating random phase...")
-            # Generate random phase
-            real_0, imag_0 = Function.randomPhase(Sw, Nrr)
-            
-            self.progress.emit("Computing IDFT...")
-            # IDFT
-            real, imag = Function.idft(real_0, imag_0, Nrr)
-            S = (np.array(real) + np.array(imag)) * 2
-            
-            self.progress.emit("Scaling RR intervals...")
-            # Scale to RR intervals
-            rr_intervals = Utility.scaling(S, hmean, hstd)
+            # Only the stages affected by changed parameters are recomputed
+            self.pipeline.set(
+                duration=self.params['duration'],
+                hmean=self.params['hmean'],
+                hstd=self.params['hstd'],
+                fs=self.params['fs'],
+                method=self.params.get('method', 'ifft')
+            )
+            stages = self.pipeline.run(
+                ['spectrum', 'phase', 'rr', 'metrics', 'morphology'],
+                callback=lambda stage: self.progress.emit(self.STAGE_MESSAGES[stage]),
+                profiler=self.profiler
+            )
             
-            self.progress.emit("Calculating HRV metrics...")
-            # Calculate HRV metrics
-            metrics = {
-                'SDNN': Utility.SDNN(rr_intervals),
-                'RMSSD': Utility.RMSSD(rr_intervals),
-                'pNN50': Utility.pNN50(rr_intervals),
-                'BPM': 60 / np.mean(rr_intervals)
+            result = {
+                'total_spectrum': stages['spectrum']['total'],
+                'sw_spectrum': stages['spectrum']['Sw'],
+                'real_phase': stages['phase'][0],
+                'imag_phase': stages['phase'][1],
+                'rr_intervals': stages['rr'],
+                'time': stages['time'],
+                'metrics': stages['metrics']
             }
+            self.rr_ready.emit(result)
             
-            self.progress.emit("Generating ECG signal...")
-            # ECG generation
-            theta = Angle(p=-60, q=-15, r=0, s=15, t=90)
-            theta.to_radians()
-            
-            Alpha = Amplitude(p=1.2, q=-5.0, r=30.0, s=-7.5, t=0.75)
-            Beta = Amplitude(p=0.25, q=0.1, r=0.1, s=0.1, t=0.4)
-            
-            hfactor1, hfactor2 = Utility.doubleFactorial(hmean)
-            Beta.scale_by(hfactor2)
+            self.progress.emit(self.STAGE_MESSAGES['ecg'])
+            chunks = []
+            streamed = 0
+            stopped = False
+            with self.profiler.stage('ecg'):
+                for chunk in self.pipeline.streamEcg(stages, self.CHUNK_SIZE):
+                    chunks.append(chunk)
+                    streamed += len(chunk)
+                    self.ecg_chunk.emit(chunk)
+                    # A cancel during the last chunk still keeps the finished ECG
+                    if self.isInterruptionRequested() and streamed < len(stages['time']):
+                        stopped = True
+                        break
             
-            theta.p *= hfactor2
-            theta.q *= hfactor1
-            theta.s *= hfactor1
-            theta.t *= hfactor2
+            if stopped:
+                self.cancelled.emit()
+                return
             
-            dt = 1 / fs
-            ecg_signal = Function.solveEcgModel(dt, Nrr, {
-                'dt': dt,
-                'rr_series': rr_intervals,
-                'ai': [Alpha.p, Alpha.q, Alpha.r, Alpha.s, Alpha.t],
-                'bi': [Beta.p, Beta.q, Beta.r, Beta.s, Beta.t],
-                'ti': [theta.p, theta.q, theta.r, theta.s, theta.t]
-            })
-            
-            time = np.arange(0, len(ecg_signal)) / fs
-            
-            result = {
-                'total_spectrum': total,
-                'sw_spectrum': Sw,
-                'real_phase': real_0,
-                'imag_phase': imag_0,
-                'rr_intervals': rr_intervals,
-                'ecg_signal': ecg_signal,
-                'time': time,
-                'metrics': metrics
-            }
+            result['ecg_signal'] = np.concatenate(chunks)
+            result['profile'] = self.profiler.lines()
             
             self.progress.emit("Generation completed!")
             self.finished.emit(result)
@@ -308,11 +368,17 @@ class MainWindow(QWidget):
         # Set default values and labels
         self.setup_defaults()
         
+        # Memoized generation pipeline shared by all runs
+        self.pipeline = Pipeline()
+        self.last_params = None
+        
         # Setup zoom-only plot widgets
         self.setup_plots()
         
-        # Connect the generate button from UI file
+        # Connect the generate and cancel buttons from UI file
         self.pushButton.clicked.connect(self.generate_signal)
+        self.cancelButton.clicked.connect(self.cancel_generation)
+        self.cancelButton.setEnabled(False)
         
         # Style the generate button
         self.pushButton.setStyleSheet("""
@@ -432,9 +498,15 @@ class MainWindow(QWidget):
         
         params = result
         
+        # Generating again with unchanged parameters asks for a new realization
+        if params == self.last_params:
+            self.pipeline.reseed()
+        self.last_params = params
+        
         # Disable button during generation
         self.pushButton.setEnabled(False)
         self.pushButton.setText("Generating...")
+        self.cancelButton.setEnabled(True)
         
         # Clear previous results
         self.textEdit.clear()
@@ -442,36 +514,45 @@ class MainWindow(QWidget):
         self.update_status(f"Parameters: Duration={params['duration']}s, HR={params['hmean']}±{params['hstd']}BPM, Fs={params['fs']}Hz")
         
         # Start generation in separate thread
-        self.generation_thread = ECGGenerationThread(params)
+        profiler = StageProfiler(memory=self.memoryCheck.isChecked())
+        self.generation_thread = ECGGenerationThread(params, self.pipeline, profiler)
+        self.generation_thread.rr_ready.connect(self.on_rr_ready)
+        self.generation_thread.ecg_chunk.connect(self.ecg_widget.append_stream)
         self.generation_thread.finished.connect(self.on_generation_finished)
+        self.generation_thread.cancelled.connect(self.on_generation_cancelled)
         self.generation_thread.progress.connect(self.update_status)
         self.generation_thread.error.connect(self.on_generation_error)
         self.generation_thread.start()
         
     def update_status(self, message):
-        # Update the text edit with status
-        current_text = self.textEdit.toPlainText()
-        self.textEdit.setPlainText(current_text + message + "\n")
+        # Append one paragraph, the existing text is neither read nor rebuilt
+        self.textEdit.append(message)
         
         # Scroll to bottom
-        cursor = self.textEdit.textCursor()
-        cursor.movePosition(cursor.End)
-        self.textEdit.setTextCursor(cursor)
+        scroll_bar = self.textEdit.verticalScrollBar()
+        scroll_bar.setValue(scroll_bar.maximum())
         
-        # Process events to update UI
-        QApplication.processEvents()
+    def cancel_generation(self):
+        self.cancelButton.setEnabled(False)
+        self.update_status("Cancelling after the current chunk...")
+        self.generation_thread.requestInterruption()
+        
+    def reset_buttons(self):
+        self.pushButton.setEnabled(True)
+        self.pushButton.setText("generate")
+        self.cancelButton.setEnabled(False)
         
     def on_generation_error(self, error_msg):
         self.update_status(error_msg)
+        self.reset_buttons()
         
-        # Re-enable button
-        self.pushButton.setEnabled(True)
-        self.pushButton.setText("generate")
+    def on_generation_cancelled(self):
+        self.update_status("Generation cancelled, the ECG shows the samples solved so far.")
+        self.reset_buttons()
         
-    def on_generation_finished(self, result):
+    def on_rr_ready(self, result):
+        """Plot the RR stages while the ECG is still being solved"""
         try:
-            self.update_status("Rendering zoom-only interactive plots...")
-            
             # Update all plots with zoom-only matplotlib graphs
             self.gaussian_widget.plot_data(
                 result['total_spectrum'], 
@@ -504,6 +585,16 @@ class MainWindow(QWidget):
                 ylabel="RR Interval (s)"
             )
             
+            # The ECG fills in chunk by chunk
+            self.ecg_widget.begin_stream(result['time'], "Time (s)", "Amplitude (mV)", color='red')
+            
+        except Exception as e:
+            self.update_status(f"Error updating plots: {str(e)}")
+        
+    def on_generation_finished(self, result):
+        try:
+            self.update_status("Rendering zoom-only interactive plots...")
+            
             self.ecg_widget.plot_xy(
                 result['time'], 
                 result['ecg_signal'],
@@ -515,6 +606,7 @@ class MainWindow(QWidget):
             # Update metrics in text area
             metrics = result['metrics']
             params = self.get_parameters()
+            timings = "\n".join(result['profile']) or "All stages reused from cache"
             
             metrics_text = f"""Generation completed successfully!
 
@@ -540,6 +632,9 @@ c2 (HF bandwidth): 0.01 Hz
 ECG Length: {len(result['ecg_signal'])} samples
 Duration: {len(result['ecg_signal'])/params['fs']:.2f} s
 RR Count: {len(result['rr_intervals'])} intervals
+
+=== Stage Timings ===
+{timings}
             """
             
             self.textEdit.setPlainText(metrics_text)
@@ -547,9 +642,7 @@ RR Count: {len(result['rr_intervals'])} intervals
         except Exception as e:
             self.update_status(f"Error updating plots: {str(e)}")
         
-        # Re-enable button
-        self.pushButton.setEnabled(True)
-        self.pushButton.setText("generate")
+        self.reset_buttons()
 
 def main():
     app = QApplication(sys.argv)